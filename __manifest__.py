@@ -9,7 +9,7 @@
         Features:
         - Real-time status: Free/Reserved/Occupied
         - 167 PR-1 locations tracked
-        - Auto-refresh every 60 seconds
+        - Live updates over the bus (polling fallback)
         - Interactive grid visualization
         - Assignment wizard
         - Historical analytics
@@ -24,10 +24,15 @@
         'stock',
         'sale',
         'web',
+        'bus',
+        'mail',
     ],
     'data': [
         'security/ir.model.access.csv',
+        'data/occupancy_data.xml',
         'views/location_occupancy_views.xml',
+        'views/location_occupancy_history_views.xml',
+        'views/location_occupancy_layout_views.xml',
         'views/location_occupancy_menu.xml',
         'views/occupancy_grid_view.xml',
         'views/assets.xml',
@@ -35,6 +40,7 @@
     'qweb': [
         'static/src/xml/occupancy_grid_templates.xml',
     ],
+    'post_init_hook': 'post_init_hook',
     'installable': True,
     'application': False,
     'auto_install': False,
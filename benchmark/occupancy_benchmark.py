@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reproducible occupancy benchmark.
+
+Builds a synthetic warehouse (one layout, N locations, M assigned orders)
+inside a transaction of an existing database, measures the hot paths and
+rolls everything back. Nothing is committed.
+
+Usage:
+    python3 benchmark/occupancy_benchmark.py -c /etc/odoo.conf -d mydb \\
+        --locations 2000 --orders 1500 --report bench.json
+
+Exits with status 1 when a metric exceeds benchmark/thresholds.json.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+import odoo
+from odoo import SUPERUSER_ID, api
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thresholds.json')
+
+LEVELS = ['E', 'D', 'C', 'B', 'A']
+
+# Tree view fields of view_stock_location_occupancy_tree
+LIST_FIELDS = [
+    'name', 'pr1_zone', 'occupancy_layout_id', 'occupancy_status',
+    'occupancy_order_name', 'occupancy_transport_unit', 'occupancy_customer',
+    'occupancy_duration_hours',
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-c', '--config', help="Odoo configuration file")
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--locations', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=600)
+    parser.add_argument('--boxed', type=float, default=0.3,
+                        help="Fraction of orders with a transport unit (occupied)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--thresholds', default=THRESHOLDS_PATH)
+    parser.add_argument('--report', help="Write the JSON report to this file")
+    return parser.parse_args()
+
+
+# ============================================
+# SYNTHETIC DATA
+# ============================================
+
+def row_names(count):
+    """A, B, ... Z, AA, AB, ..."""
+    names = []
+    for i in range(count):
+        name = ''
+        i += 1
+        while i:
+            i, rem = divmod(i - 1, 26)
+            name = string.ascii_uppercase[rem] + name
+        names.append(name)
+    return names
+
+
+def create_warehouse(env, location_count):
+    """Root view location, a layout and Row-Level-Column children"""
+    Location = env['stock.location']
+    columns = 20
+    rows = row_names(-(-location_count // (columns * len(LEVELS))))
+    root = Location.create({'name': 'BENCH', 'usage': 'view'})
+    layout = env['location.occupancy.layout'].create({
+        'name': 'BENCH',
+        'root_location_id': root.id,
+        'row_order': ','.join(rows),
+        'level_order': ','.join(LEVELS),
+    })
+    names = [
+        f"{row}-{level}-{column:02d}"
+        for row in rows for level in LEVELS for column in range(1, columns + 1)
+    ][:location_count]
+    locations = Location.create([
+        {'name': name, 'location_id': root.id, 'usage': 'internal'} for name in names
+    ])
+    return layout, locations
+
+
+def create_transport_units(env, count):
+    """Transport units with whatever of name/code the comodel has"""
+    comodel = env['sale.order']._fields['transport_unit_id'].comodel_name
+    TransportUnit = env[comodel]
+    vals_list = []
+    for i in range(count):
+        vals = {}
+        for field in ('name', 'code'):
+            if field in TransportUnit._fields:
+                vals[field] = f"BENCH-{i:05d}"
+        vals_list.append(vals)
+    return TransportUnit.create(vals_list)
+
+
+def create_orders(env, locations, order_count, boxed, rng):
+    """Orders spread across occupancy states, written per state group"""
+    from odoo.addons.personalizirai_location_occupancy.models.stock_location import (
+        OCCUPANCY_ORDER_STATES,
+    )
+    partner = env['res.partner'].create({'name': 'Benchmark Customer'})
+    targets = rng.sample(locations.ids, min(order_count, len(locations)))
+    orders = env['sale.order'].create([
+        {'partner_id': partner.id, 'source_location_id': location_id}
+        for location_id in targets
+    ])
+    units = create_transport_units(env, int(len(orders) * boxed))
+    boxed_orders = orders[:len(units)]
+    for order, unit in zip(boxed_orders, units):
+        order.transport_unit_id = unit
+    for index, state in enumerate(OCCUPANCY_ORDER_STATES):
+        orders.filtered(lambda o: o.id % len(OCCUPANCY_ORDER_STATES) == index).write({'state': state})
+    return orders
+
+
+# ============================================
+# MEASUREMENT
+# ============================================
+
+def measure(env, func, repeat):
+    """Median wall time (ms) and SQL query count over cold-cache runs"""
+    cr = env.cr
+    timings, queries = [], []
+    for _i in range(repeat):
+        env['stock.location'].invalidate_cache()
+        start_count = cr.sql_log_count
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(cr.sql_log_count - start_count)
+    return {
+        'ms': round(statistics.median(timings), 2),
+        'queries': int(statistics.median(queries)),
+    }
+
+
+def run(env, args):
+    rng = random.Random(args.seed)
+    ICP = env['ir.config_parameter']
+    sql_engine_key = 'personalizirai_location_occupancy.sql_engine'
+
+    layout, locations = create_warehouse(env, args.locations)
+    create_orders(env, locations, args.orders, args.boxed, rng)
+    env['stock.location'].flush()
+
+    def fetch(engine):
+        ICP.set_param(sql_engine_key, '1' if engine == 'sql' else False)
+        return lambda: locations._fetch_occupancy_values()
+
+    results = {}
+    results['fetch_orm'] = measure(env, fetch('orm'), args.repeat)
+    results['fetch_sql'] = measure(env, fetch('sql'), args.repeat)
+    ICP.set_param(sql_engine_key, False)
+    results['backfill'] = measure(env, env['stock.location']._backfill_occupancy, args.repeat)
+    results['grid_build'] = measure(env, layout._build_grid_data, args.repeat)
+    results['list_read'] = measure(
+        env, lambda: env['stock.location'].search_read(
+            [('occupancy_layout_id', '=', layout.id)], LIST_FIELDS, limit=80),
+        args.repeat)
+    return results
+
+
+def check(results, thresholds):
+    failures = []
+    for metric, result in results.items():
+        limits = thresholds.get(metric, {})
+        result['passed'] = True
+        for key, measured in (('max_ms', result['ms']), ('max_queries', result['queries'])):
+            if key in limits and measured > limits[key]:
+                result['passed'] = False
+                failures.append(f"{metric}: {measured} > {key} {limits[key]}")
+    return failures
+
+
+def main():
+    args = parse_args()
+    odoo.tools.config.parse_config(['-c', args.config] if args.config else [])
+    with open(args.thresholds) as f:
+        thresholds = json.load(f)
+
+    registry = odoo.registry(args.database)
+    with registry.cursor() as cr:
+        try:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            results = run(env, args)
+        finally:
+            cr.rollback()
+
+    failures = check(results, thresholds)
+    report = {
+        'database': args.database,
+        'locations': args.locations,
+        'orders': args.orders,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+        'passed': not failures,
+    }
+    output = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(output)
+    print(output)
+    for failure in failures:
+        print(f"❌ {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+import odoo
+from odoo import http, fields
+from odoo.http import request, content_disposition, Response
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+_logger = logging.getLogger(__name__)
+
+# Rows fetched per query while exporting
+EXPORT_BATCH_SIZE = 2000
+
+# Size of the chunks an XLSX file is sent in
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+GRID_EXPORT_HEADER = [
+    'Layout', 'Location', 'Row', 'Level', 'Column', 'Status', 'Order',
+    'Customer', 'Transport Box', 'Since (UTC)', 'Duration (h)',
+]
+
+GRID_EXPORT_QUERY = """
+    SELECT lay.name, l.name, l.occupancy_row, l.occupancy_level, l.occupancy_column_label,
+           l.occupancy_status, l.occupancy_order_name, l.occupancy_customer,
+           l.occupancy_transport_unit, l.occupancy_since,
+           round((EXTRACT(EPOCH FROM (now() AT TIME ZONE 'UTC') - l.occupancy_since) / 3600)::numeric, 1)::float,
+           l.occupancy_layout_id, l.occupancy_row_seq, l.occupancy_row,
+           l.occupancy_level_seq, l.occupancy_level, l.occupancy_column, l.id
+      FROM stock_location l
+      JOIN location_occupancy_layout lay ON lay.id = l.occupancy_layout_id
+     WHERE l.active AND l.usage = 'internal'
+       AND (%(layout_id)s IS NULL OR l.occupancy_layout_id = %(layout_id)s)
+"""
+GRID_EXPORT_KEY = [
+    'l.occupancy_layout_id', 'l.occupancy_row_seq', 'l.occupancy_row',
+    'l.occupancy_level_seq', 'l.occupancy_level', 'l.occupancy_column', 'l.id',
+]
+
+HISTORY_EXPORT_HEADER = ['Timestamp (UTC)', 'Layout', 'Location', 'From', 'To', 'Order']
+
+HISTORY_EXPORT_QUERY = """
+    SELECT h.timestamp, lay.name, l.name, h.from_status, h.to_status, so.name,
+           h.timestamp, h.id
+      FROM location_occupancy_history h
+      JOIN stock_location l ON l.id = h.location_id
+ LEFT JOIN location_occupancy_layout lay ON lay.id = l.occupancy_layout_id
+ LEFT JOIN sale_order so ON so.id = h.order_id
+     WHERE h.timestamp >= %(date_from)s AND h.timestamp < %(date_to)s
+       AND (%(layout_id)s IS NULL OR l.occupancy_layout_id = %(layout_id)s)
+"""
+HISTORY_EXPORT_KEY = ['h.timestamp', 'h.id']
+
+
+def _iter_batches(dbname, query, key_columns, params):
+    """
+    Yield the rows of query in keyset-paginated batches.
+
+    Runs on a cursor of its own: the response body is produced after the
+    request cursor is closed. Each batch continues after the key of the
+    previous one, so memory is bounded by EXPORT_BATCH_SIZE.
+    """
+    order_by = ', '.join(key_columns)
+    key = None
+    with odoo.registry(dbname).cursor() as cr:
+        while True:
+            after = f"AND ({order_by}) > %(key)s" if key else ''
+            cr.execute(f"{query} {after} ORDER BY {order_by} LIMIT {EXPORT_BATCH_SIZE}",
+                       dict(params, key=key))
+            rows = cr.fetchall()
+            if not rows:
+                return
+            yield rows
+            key = tuple(rows[-1][-len(key_columns):])
+
+
+def _format_cell(value):
+    if isinstance(value, datetime):
+        return fields.Datetime.to_string(value)
+    return value
+
+
+def _stream_csv(header, batches):
+    """CSV body, one chunk per batch"""
+    width = len(header)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')  # Lets Excel detect UTF-8 (Cyrillic names)
+    writer.writerow(header)
+    for rows in batches:
+        for row in rows:
+            writer.writerow([_format_cell(value) for value in row[:width]])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def _stream_xlsx(header, batches):
+    """
+    XLSX body. The workbook is written row by row to a temporary file
+    (constant_memory) and sent in chunks once complete.
+    """
+    width = len(header)
+    with tempfile.TemporaryFile() as output:
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        sheet = workbook.add_worksheet('Occupancy')
+        bold = workbook.add_format({'bold': True})
+        sheet.write_row(0, 0, header, bold)
+        row_index = 1
+        for rows in batches:
+            for row in rows:
+                sheet.write_row(row_index, 0, [_format_cell(value) for value in row[:width]])
+                row_index += 1
+        workbook.close()
+
+        output.seek(0)
+        chunk = output.read(EXPORT_CHUNK_SIZE)
+        while chunk:
+            yield chunk
+            chunk = output.read(EXPORT_CHUNK_SIZE)
+
+
+class LocationOccupancyExport(http.Controller):
+    """Streaming CSV/XLSX downloads of the grid and the occupancy history"""
+
+    @http.route('/occupancy/export/<string:kind>', type='http', auth='user', methods=['GET'])
+    def export(self, kind, file_format='csv', layout_id=None, date_from=None, date_to=None):
+        """
+        Streams an export file
+        
+        Endpoint: /occupancy/export/grid?file_format=xlsx&layout_id=1
+                  /occupancy/export/history?date_from=2025-01-01&date_to=2025-12-31
+        Method: GET
+        Auth: Requires logged-in user
+        
+        kind: 'grid' (current state of every location) or 'history'
+              (transitions between date_from and date_to, inclusive;
+              default: the last 30 days)
+        file_format: 'csv' (streams immediately) or 'xlsx'
+        layout_id: optional, restricts to one warehouse layout
+        """
+        if kind not in ('grid', 'history') or file_format not in ('csv', 'xlsx'):
+            return request.not_found()
+        if file_format == 'xlsx' and not xlsxwriter:
+            return Response('XLSX export requires the xlsxwriter library', status=501)
+
+        params = {'layout_id': int(layout_id) if layout_id else None}
+        if kind == 'grid':
+            request.env['stock.location'].check_access_rights('read')
+            header, query, key = GRID_EXPORT_HEADER, GRID_EXPORT_QUERY, GRID_EXPORT_KEY
+        else:
+            request.env['location.occupancy.history'].check_access_rights('read')
+            today = fields.Date.context_today(request.env.user)
+            params['date_from'] = fields.Date.to_date(date_from) or today - timedelta(days=30)
+            params['date_to'] = (fields.Date.to_date(date_to) or today) + timedelta(days=1)
+            header, query, key = HISTORY_EXPORT_HEADER, HISTORY_EXPORT_QUERY, HISTORY_EXPORT_KEY
+
+        batches = _iter_batches(request.env.cr.dbname, query, key, params)
+        if file_format == 'csv':
+            body = _stream_csv(header, batches)
+            content_type = 'text/csv; charset=utf-8'
+        else:
+            body = _stream_xlsx(header, batches)
+            content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+        filename = f"occupancy_{kind}_{fields.Date.to_string(fields.Date.today())}.{file_format}"
+        _logger.info(f"Exporting occupancy {kind} as {file_format} for {request.env.user.login}")
+        return Response(body, headers=[
+            ('Content-Type', content_type),
+            ('Content-Disposition', content_disposition(filename)),
+            ('Cache-Control', 'no-store'),
+        ], direct_passthrough=True)
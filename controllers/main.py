@@ -1,23 +1,45 @@
 # -*- coding: utf-8 -*-
 
+import gzip
 import json
 import logging
-from odoo import http
-from odoo.http import request
+import time
+from odoo import fields, http, SUPERUSER_ID
+from odoo.http import request, Response
+from odoo.exceptions import UserError
+from odoo.tools import consteq
+
+from ..models.location_occupancy_history import HOURLY_RETENTION_DAYS
+from ..tools import metrics
 
 _logger = logging.getLogger(__name__)
 
+# Rebuild a snapshot after this many seconds even if nothing changed,
+# so durations shown in the details modal do not drift for too long
+SNAPSHOT_MAX_AGE = 600
+
+# Per-process copy of the last grid response per layout, in front of the
+# shared location.occupancy.snapshot table. A copy is current while the
+# number of change log rows at or after its version has not moved.
+# Structure: {(dbname, layout_id): (version, seen, fetched_at, response)}
+_grid_snapshots = {}
+
+# Fallback poll interval (seconds) suggested to clients, which back off
+# from it while nothing changes; the bus delivers changes in between
+DEFAULT_POLL_INTERVAL = 300
+
 
 class LocationOccupancyController(http.Controller):
     """
     HTTP Controller for Location Occupancy Grid Dashboard
-    
+
     Provides JSON endpoint for real-time location status data
     organized by physical warehouse structure (Rows & Levels).
     """
 
     @http.route('/occupancy/grid_data', type='json', auth='user', methods=['POST'])
-    def get_grid_data(self):
+    def get_grid_data(self, version=None, layout_id=None, row_offset=None, row_limit=None, levels=None,
+                      as_of=None):
         """
         Returns location occupancy data organized by physical structure
         
@@ -25,8 +47,31 @@ class LocationOccupancyController(http.Controller):
         Method: POST (JSON-RPC)
         Auth: Requires logged-in user
         
+        Params:
+            version: occupancy version of the client's current data.
+                     When nothing changed since, only
+                     {"success": true, "unchanged": true, "version": N}
+                     is returned.
+            layout_id: location.occupancy.layout to show (default: first)
+            row_offset, row_limit, levels: optional window. When given,
+                     only those rows (and levels) are returned, plus a
+                     light "row_index" describing every row, and no
+                     summary (see /occupancy/grid_summary).
+            as_of: UTC datetime ("2024-05-01 14:30:00"). When given, the
+                     grid is replayed as it was at that moment from
+                     the transition log: "version" is null, "as_of"
+                     echoes the moment and the summary is always
+                     included. Transport boxes are not shown.
+        
+        Every successful response carries "next_poll": the number of
+        seconds the client should wait before its next fallback poll.
+        
         Response format:
         {
+            "success": true,
+            "version": 42,
+            "layout": {"id": 1, "name": "PR-1"},
+            "layouts": [{"id": 1, "name": "PR-1"}, ...],
             "summary": {
                 "total": 131,
                 "free": 85,
@@ -48,169 +93,577 @@ class LocationOccupancyController(http.Controller):
                         ...
                     ]
                 },
-                {
-                    "name": "B",
-                    "label": "РЕДИЦА B",
-                    "count": 61,
-                    "column_numbers": ["01", "02", ..., "13"],
-                    "levels": [...]
-                }
+                ...
             ]
         }
         """
+        metrics.inc('occupancy_requests_total', endpoint='grid_data')
         try:
-            _logger.info("🎨 Grid data request received")
-            
-            # Get location model
-            Location = request.env['stock.location']
-            
-            # Query all PR-1 locations (location_id = 19)
-            locations = Location.search([
-                ('usage', '=', 'internal'),
-                ('location_id', '=', 19)
-            ], order='name')
-            
-            _logger.info(f"📦 Found {len(locations)} PR-1 locations")
-            
-            # Read all data in batch (efficient!)
-            location_data = locations.read([
-                'id', 'name', 'barcode',
-                'occupancy_status',
-                'occupancy_order_name',
-                'occupancy_customer',
-                'occupancy_duration_hours',
-                'occupancy_transport_unit',  # NEW: Transport box info
-                'pr1_zone'
-            ])
-            
-            # Initialize summary counters
-            summary = {
-                'total': len(location_data),
-                'free': 0,
-                'reserved': 0,
-                'occupied': 0
-            }
-            
-            # Group locations by Row and Level
-            # Structure: rows[row_name][level_name] = [locations]
-            rows_data = {
-                'A': {'E': [], 'D': [], 'C': [], 'B': [], 'A': []},
-                'B': {'E': [], 'D': [], 'C': [], 'B': [], 'A': []}
+            with metrics.timed('grid_data'):
+                result = self._get_grid_data(version, layout_id, row_offset, row_limit, levels, as_of)
+                if result.get('success'):
+                    # Copy: the full response may be a cached snapshot
+                    result = dict(result, next_poll=self._next_poll_hint())
+                return result
+        except Exception as e:
+            metrics.inc('occupancy_errors_total', endpoint='grid_data')
+            _logger.error(f"❌ Error fetching grid data: {e}", exc_info=True)
+            return self._error_response(str(e))
+
+    def _get_grid_data(self, version, layout_id, row_offset, row_limit, levels, as_of=None):
+        """Grid data for get_grid_data; see its docstring"""
+        _logger.debug("🎨 Grid data request received")
+        
+        layout = self._get_layout(layout_id)
+        if not layout:
+            return self._error_response('No occupancy layout configured')
+        
+        if as_of:
+            return self._get_grid_data_as_of(layout, as_of, row_offset, row_limit, levels)
+        
+        Location = request.env['stock.location']
+        if version is not None and Location._get_occupancy_changes(int(version)) == (set(), False):
+            metrics.inc('occupancy_grid_snapshot_total', result='unchanged')
+            return {
+                'success': True,
+                'unchanged': True,
+                'version': Location._get_occupancy_version(),
             }
+        
+        # Serve this process' snapshot if nothing changed since and still fresh
+        key = (request.env.cr.dbname, layout.id)
+        snapshot = _grid_snapshots.get(key)
+        if (snapshot and time.time() - snapshot[2] < SNAPSHOT_MAX_AGE
+                and Location._count_occupancy_changes(snapshot[0]) == snapshot[1]):
+            metrics.inc('occupancy_grid_snapshot_total', result='hit')
+            response = snapshot[3]
+        else:
+            # Shared by all workers; rebuilt by one of them at a time
+            metrics.inc('occupancy_grid_snapshot_total', result='miss')
+            snapshot_version, seen, response = request.env['location.occupancy.snapshot'].sudo()._get_grid_data(
+                layout, SNAPSHOT_MAX_AGE)
+            _grid_snapshots[key] = (snapshot_version, seen, time.time(), response)
+        
+        if row_offset is None and row_limit is None and levels is None:
+            return response
+        return self._window_response(response, row_offset, row_limit, levels)
+
+    @http.route('/occupancy/grid_packed', type='http', auth='user', methods=['GET'])
+    def get_grid_packed(self, version=None, layout_id=None, row_offset=None, row_limit=None, levels=None,
+                        as_of=None):
+        """
+        Same data as /occupancy/grid_data in the packed columnar format
+        
+        Endpoint: /occupancy/grid_packed?layout_id=1&row_offset=0&row_limit=2&levels=E,D
+        Method: GET
+        Auth: Requires logged-in user
+        
+        Rows are returned as parallel arrays per level (see
+        location.occupancy.layout._pack_rows), gzip-compressed when the
+        client accepts it. Cells only carry id, column, label, status and
+        order; other details come from /occupancy/location/<id>.
+        as_of replays the grid at a past moment, as in /occupancy/grid_data.
+        """
+        metrics.inc('occupancy_requests_total', endpoint='grid_packed')
+        try:
+            with metrics.timed('grid_packed'):
+                result = self._get_grid_data(
+                    int(version) if version not in (None, '') else None,
+                    layout_id or None,
+                    row_offset,
+                    row_limit,
+                    levels.split(',') if levels else None,
+                    as_of or None)
+                if result.get('success') and 'rows' in result:
+                    layout = request.env['location.occupancy.layout']
+                    result = dict(result, **layout._pack_rows(result['rows']))
+        except Exception as e:
+            metrics.inc('occupancy_errors_total', endpoint='grid_packed')
+            _logger.error(f"❌ Error fetching packed grid data: {e}", exc_info=True)
+            result = self._error_response(str(e))
+        
+        body = json.dumps(result, separators=(',', ':'), default=str).encode()
+        headers = [('Content-Type', 'application/json'), ('Cache-Control', 'no-store')]
+        if 'gzip' in request.httprequest.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=6)
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Content-Length', str(len(body))))
+        return request.make_response(body, headers)
+
+    @http.route('/occupancy/location/<int:location_id>', type='json', auth='user', methods=['POST'])
+    def get_location_details(self, location_id):
+        """
+        Returns the full details of one grid location
+        
+        Endpoint: /occupancy/location/<id>
+        Method: POST (JSON-RPC)
+        Auth: Requires logged-in user
+        
+        Called when the details modal opens, so grid payloads do not need
+        to carry customer, transport box and duration of every cell.
+        
+        Response format:
+        {
+            "success": true,
+            "location": {...grid_data location fields..., "magento_id": "...",
+                         "since": "2025-11-13 08:00:00", "rate_7d": 42.5,
+                         "times_used_7d": 3, "last_freed": "..."}
+        }
+        """
+        metrics.inc('occupancy_requests_total', endpoint='location')
+        try:
+            with metrics.timed('location'):
+                location = request.env['stock.location'].browse(location_id).exists()
+                if not location or not location.occupancy_layout_id:
+                    return {'success': False, 'error': 'Location not found'}
+                return {
+                    'success': True,
+                    'location': location.occupancy_layout_id._get_location_details(location),
+                }
+        except Exception as e:
+            metrics.inc('occupancy_errors_total', endpoint='location')
+            _logger.error(f"❌ Error fetching location {location_id}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+
+    @http.route('/occupancy/grid_delta', type='json', auth='user', methods=['POST'])
+    @metrics.timed('grid_delta')
+    def get_grid_delta(self, since_version, layout_id=None):
+        """
+        Returns only the cells that changed after since_version
+        
+        Cells changed by transactions that were still running when
+        since_version was read are included, so a cell may be sent again
+        by the next delta; patching is idempotent.
+        
+        Endpoint: /occupancy/grid_delta
+        Method: POST (JSON-RPC)
+        Auth: Requires logged-in user
+        
+        Response format:
+        {
+            "success": true,
+            "version": 45,
+            "summary": {"total": 131, "free": 84, "reserved": 47, "occupied": 0},
+            "cells": [{...same format as grid_data locations...}],
+            "reload": false
+        }
+        
+        "reload" is true when a change cannot be patched in place
+        (location added, moved or archived); the client should then
+        fetch /occupancy/grid_data again.
+        """
+        metrics.inc('occupancy_requests_total', endpoint='grid_delta')
+        try:
+            Location = request.env['stock.location']
+            layout = self._get_layout(layout_id)
+            current_version = Location._get_occupancy_version()
+            changed_ids, reload = Location._get_occupancy_changes(int(since_version or 0))
+            if not changed_ids and not reload:
+                return {
+                    'success': True,
+                    'unchanged': True,
+                    'version': current_version,
+                    'next_poll': self._next_poll_hint(),
+                }
             
-            # Process each location
-            for loc in location_data:
-                status = loc['occupancy_status']
-                
-                # Update summary
-                if status == 'free':
-                    summary['free'] += 1
-                elif status == 'reserved':
-                    summary['reserved'] += 1
-                elif status == 'occupied':
-                    summary['occupied'] += 1
-                
-                # Parse location name: A-E-05 → Row=A, Level=E, Column=05
-                try:
-                    parts = loc['name'].split('-')
-                    if len(parts) >= 3:
-                        row = parts[0]      # A or B
-                        level = parts[1]    # A, B, C, D, E
-                        col_num = int(parts[2])  # 01, 02, 03...
-                        
-                        # Format location data for frontend
-                        location_item = {
-                            'id': loc['id'],
-                            'name': loc['name'],
-                            'display_name': f"{row}-{level}-{parts[2]}",  # Keep leading zeros
-                            'row': row,
-                            'level': level,
-                            'column': col_num,
-                            'column_label': parts[2],  # "01", "02" with leading zeros
-                            'status': status,
-                            'order': loc['occupancy_order_name'] or None,
-                            'customer': loc['occupancy_customer'] or None,
-                            'duration': round((loc['occupancy_duration_hours'] or 0) / 24, 1),
-                            'transport_unit': loc['occupancy_transport_unit'] or None  # NEW
-                        }
-                        
-                        # Add to appropriate row and level
-                        if row in rows_data and level in rows_data[row]:
-                            rows_data[row][level].append(location_item)
-                        else:
-                            _logger.warning(f"⚠️ Unknown row/level: {loc['name']}")
-                    else:
-                        _logger.warning(f"⚠️ Invalid name format: {loc['name']}")
-                except Exception as e:
-                    _logger.error(f"❌ Error parsing location {loc.get('name')}: {e}")
-            
-            # Sort locations within each level by column number
-            for row in rows_data:
-                for level in rows_data[row]:
-                    rows_data[row][level].sort(key=lambda x: x['column'])
-            
-            # Build response structure
-            # Level order: E (top) → D → C → B → A (bottom)
-            level_order = ['E', 'D', 'C', 'B', 'A']
-            level_labels = {
-                'E': 'Ниво E (Горе)',
-                'D': 'Ниво D',
-                'C': 'Ниво C',
-                'B': 'Ниво B',
-                'A': 'Ниво A (Долу)'
-            }
+            changed = Location.with_context(active_test=False).browse(sorted(changed_ids)).exists()
+            # Only cells of this grid are patched: changes in other layouts
+            # and in tracked zone slots outside the grid do not concern it.
+            # Locations entering or leaving the grid logged a reload.
+            relevant = changed.filtered(lambda l: l.occupancy_layout_id == layout)
+            in_grid = Location.search(layout._grid_domain() + [('id', 'in', relevant.ids)])
+            if reload:
+                return {
+                    'success': True,
+                    'reload': True,
+                    'version': current_version,
+                    'next_poll': self._next_poll_hint(),
+                }
             
-            rows = []
-            for row_name in ['A', 'B']:
-                # Count locations in this row
-                row_count = sum(len(rows_data[row_name][lvl]) for lvl in level_order)
-                
-                # Determine max columns for this row
-                max_col = 0
-                for level in level_order:
-                    for loc in rows_data[row_name][level]:
-                        if loc['column'] > max_col:
-                            max_col = loc['column']
-                
-                # Generate column numbers array
-                column_numbers = [f"{i:02d}" for i in range(1, max_col + 1)]
-                
-                # Build levels array
-                levels = []
-                for level_name in level_order:
-                    levels.append({
-                        'name': level_name,
-                        'label': level_labels[level_name],
-                        'count': len(rows_data[row_name][level_name]),
-                        'locations': rows_data[row_name][level_name]
-                    })
-                
-                rows.append({
-                    'name': row_name,
-                    'label': f'РЕДИЦА {row_name}',
-                    'emoji': '📦',
-                    'count': row_count,
-                    'column_numbers': column_numbers,
-                    'levels': levels
-                })
+            cells = layout._read_grid_cells(in_grid)
             
-            response = {
+            return {
                 'success': True,
-                'summary': summary,
-                'rows': rows
+                'version': current_version,
+                'summary': layout._grid_summary(),
+                'cells': cells,
+                'reload': False,
+                'next_poll': self._next_poll_hint(),
             }
-            
-            _logger.info(f"✅ Grid data prepared: {summary}")
-            _logger.info(f"   Row A: {rows[0]['count']} locations, {len(rows[0]['column_numbers'])} columns")
-            _logger.info(f"   Row B: {rows[1]['count']} locations, {len(rows[1]['column_numbers'])} columns")
-            
-            return response
-            
+        
         except Exception as e:
-            _logger.error(f"❌ Error fetching grid data: {e}", exc_info=True)
+            metrics.inc('occupancy_errors_total', endpoint='grid_delta')
+            _logger.error(f"❌ Error fetching grid delta: {e}", exc_info=True)
             return {
                 'success': False,
                 'error': str(e),
-                'summary': {'total': 0, 'free': 0, 'reserved': 0, 'occupied': 0},
-                'rows': []
             }
+
+    @http.route('/occupancy/grid_summary', type='json', auth='user', methods=['POST'])
+    @metrics.timed('grid_summary')
+    def get_grid_summary(self, layout_id=None):
+        """
+        Returns only the status counters of a layout (one aggregate query)
+        
+        Endpoint: /occupancy/grid_summary
+        Method: POST (JSON-RPC)
+        Auth: Requires logged-in user
+        
+        Response format:
+        {
+            "success": true,
+            "version": 42,
+            "summary": {"total": 131, "free": 85, "reserved": 46, "occupied": 0}
+        }
+        """
+        metrics.inc('occupancy_requests_total', endpoint='grid_summary')
+        try:
+            layout = self._get_layout(layout_id)
+            if not layout:
+                return self._error_response('No occupancy layout configured')
+            return {
+                'success': True,
+                'version': request.env['stock.location']._get_occupancy_version(),
+                'summary': layout._grid_summary(),
+            }
+        except Exception as e:
+            metrics.inc('occupancy_errors_total', endpoint='grid_summary')
+            _logger.error(f"❌ Error fetching grid summary: {e}", exc_info=True)
+            return self._error_response(str(e))
+
+    @http.route('/occupancy/heatmap', type='json', auth='user', methods=['POST'])
+    def get_heatmap(self, layout_id=None, days=30):
+        """
+        Returns the utilization of every cell over the last days
+        
+        Endpoint: /occupancy/heatmap
+        Method: POST (JSON-RPC)
+        Auth: Requires logged-in user
+        
+        Read from the hourly rollups (up to the last full hour).
+        
+        Response format:
+        {
+            "success": true,
+            "days": 30,
+            "cells": {"123": {"busy": 0.82, "occupied": 0.4}, ...},
+            "levels": {"A-E": 0.65, ...},
+            "columns": {"A-05": 0.71, ...}
+        }
+        """
+        metrics.inc('occupancy_requests_total', endpoint='heatmap')
+        try:
+            with metrics.timed('heatmap'):
+                request.env['location.occupancy.history.hourly'].check_access_rights('read')
+                layout = self._get_layout(layout_id)
+                if not layout:
+                    return self._error_response('No occupancy layout configured')
+                days = min(max(int(days), 1), HOURLY_RETENTION_DAYS)
+                heatmap = request.env['location.occupancy.history'].sudo()._get_heatmap(layout, days)
+                return dict(heatmap, success=True, days=days)
+        except Exception as e:
+            metrics.inc('occupancy_errors_total', endpoint='heatmap')
+            _logger.error(f"❌ Error fetching heatmap: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+
+    @http.route('/occupancy/scan', type='json', auth='user', methods=['POST'])
+    def scan(self, barcode=None, barcodes=None):
+        """
+        Resolves scanned location barcodes to their occupancy
+        
+        Endpoint: /occupancy/scan
+        Method: POST (JSON-RPC)
+        Auth: Requires logged-in user
+        
+        Params: barcode: "PR1-A-E-05", or barcodes: [...] for a batch
+        
+        Response format:
+        {
+            "success": true,
+            "results": [
+                {"barcode": "PR1-A-E-05", "found": true,
+                 "location": {...same format as grid_data locations...}},
+                {"barcode": "UNKNOWN", "found": false, "location": null}
+            ]
+        }
+        """
+        metrics.inc('occupancy_requests_total', endpoint='scan')
+        try:
+            with metrics.timed('scan'):
+                request.env['stock.location'].check_access_rights('read')
+                codes = list(barcodes or []) + ([barcode] if barcode else [])
+                results = request.env['stock.location'].sudo()._scan_occupancy(
+                    [str(code).strip() for code in codes])
+                return {
+                    'success': True,
+                    'results': [
+                        {'barcode': code, 'found': bool(cell), 'location': cell}
+                        for code, cell in results
+                    ],
+                }
+        except Exception as e:
+            metrics.inc('occupancy_errors_total', endpoint='scan')
+            _logger.error(f"❌ Error scanning barcodes: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+
+    @http.route('/occupancy/search', type='json', auth='user', methods=['POST'])
+    def search_locations(self, query, layout_id=None, limit=200):
+        """
+        Finds grid locations by order, Magento ID, customer or transport box
+        
+        Endpoint: /occupancy/search
+        Method: POST (JSON-RPC)
+        Auth: Requires logged-in user
+        
+        Every word of query must appear (substring, case-insensitive).
+        
+        Response format:
+        {
+            "success": true,
+            "matches": [{"id": 123, "row": "A"}, ...]
+        }
+        """
+        metrics.inc('occupancy_requests_total', endpoint='search')
+        try:
+            with metrics.timed('search'):
+                request.env['stock.location'].check_access_rights('read')
+                layout = self._get_layout(layout_id)
+                matches = request.env['stock.location'].sudo()._search_occupancy(
+                    query, layout=layout, limit=min(int(limit), 1000))
+                return {
+                    'success': True,
+                    'matches': [{'id': location_id, 'row': row} for location_id, row in matches],
+                }
+        except Exception as e:
+            metrics.inc('occupancy_errors_total', endpoint='search')
+            _logger.error(f"❌ Error searching locations: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+
+    @http.route('/occupancy/allocate', type='json', auth='user', methods=['POST'])
+    def allocate_location(self, order_id, layout_id=None, near_location_id=None):
+        """
+        Picks the nearest free location for an order and reserves it
+        
+        Endpoint: /occupancy/allocate
+        Method: POST (JSON-RPC)
+        Auth: Requires logged-in user (with write access to the order)
+        
+        Safe to call concurrently: parallel calls never return the same
+        location (see stock.location._allocate_free_location).
+        
+        Response format:
+        {
+            "success": true,
+            "location": {...same format as grid_data locations...}
+        }
+        """
+        metrics.inc('occupancy_requests_total', endpoint='allocate')
+        try:
+            with metrics.timed('allocate'):
+                order = request.env['sale.order'].browse(int(order_id)).exists()
+                if not order:
+                    return {'success': False, 'error': 'Order not found'}
+                order.check_access_rights('write')
+                order.check_access_rule('write')
+                
+                layout = self._get_layout(layout_id)
+                near_location = request.env['stock.location'].browse(int(near_location_id or 0)).exists()
+                location = request.env['stock.location'].sudo()._allocate_free_location(
+                    order.sudo(), layout=layout.sudo(), near_location=near_location.sudo())
+                return {
+                    'success': True,
+                    'location': location.occupancy_layout_id._read_grid_cells(location)[0],
+                }
+        except UserError as e:
+            return {'success': False, 'error': e.name}
+        except Exception as e:
+            metrics.inc('occupancy_errors_total', endpoint='allocate')
+            _logger.error(f"❌ Error allocating location for order {order_id}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+
+    @http.route('/occupancy/bulk/clear', type='json', auth='user', methods=['POST'])
+    def bulk_clear(self, location_ids):
+        """
+        Unassigns every active order from the given locations
+        
+        Endpoint: /occupancy/bulk/clear
+        Params: location_ids: [1, 2, ...]
+        """
+        return self._bulk_operation('clear', lambda Location: Location.browse(
+            [int(location_id) for location_id in location_ids])._bulk_clear_locations())
+
+    @http.route('/occupancy/bulk/reassign', type='json', auth='user', methods=['POST'])
+    def bulk_reassign(self, assignments):
+        """
+        Assigns orders to locations
+        
+        Endpoint: /occupancy/bulk/reassign
+        Params: assignments: [[order_id, location_id or false], ...]
+        """
+        return self._bulk_operation('reassign', lambda Location: Location._bulk_assign_orders({
+            int(order_id): int(location_id) if location_id else False
+            for order_id, location_id in assignments
+        }))
+
+    @http.route('/occupancy/bulk/move', type='json', auth='user', methods=['POST'])
+    def bulk_move(self, moves):
+        """
+        Moves the active orders of locations to free locations
+        
+        Endpoint: /occupancy/bulk/move
+        Params: moves: [[from_location_id, to_location_id], ...]
+        """
+        return self._bulk_operation('move', lambda Location: Location._bulk_move_locations({
+            int(from_id): int(to_id) for from_id, to_id in moves
+        }))
+
+    def _bulk_operation(self, operation, run):
+        """
+        Run a bulk operation as a stock manager, in the request transaction
+        
+        Response format:
+        {
+            "success": true,
+            "version": 45,
+            "location_count": 70
+        }
+        """
+        endpoint = f'bulk_{operation}'
+        metrics.inc('occupancy_requests_total', endpoint=endpoint)
+        try:
+            if not request.env.user.has_group('stock.group_stock_manager'):
+                return {'success': False, 'error': 'Only stock managers can run bulk operations'}
+            with metrics.timed(endpoint):
+                Location = request.env['stock.location'].sudo()
+                locations = run(Location)
+                return {
+                    'success': True,
+                    'version': Location._get_occupancy_version(),
+                    'location_count': len(locations),
+                }
+        except UserError as e:
+            request.env.cr.rollback()
+            return {'success': False, 'error': e.name}
+        except Exception as e:
+            request.env.cr.rollback()
+            metrics.inc('occupancy_errors_total', endpoint=endpoint)
+            _logger.error(f"❌ Error in bulk {operation}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e)}
+
+    @http.route('/occupancy/metrics', type='http', auth='none', methods=['GET'], csrf=False)
+    def get_metrics(self, token=None):
+        """
+        Prometheus metrics of this process (text exposition format)
+        
+        Endpoint: /occupancy/metrics
+        Method: GET
+        Auth: logged-in user, or ?token= / "Authorization: Bearer <token>"
+              matching the personalizirai_location_occupancy.metrics_token
+              parameter (for scrapers)
+        
+        Request, SQL and cache counters are per worker process, labelled
+        with its pid; location counts per status are read at scrape time.
+        """
+        if not request.db:
+            return request.not_found()
+        env = request.env(user=SUPERUSER_ID)
+        expected = env['ir.config_parameter'].get_param('personalizirai_location_occupancy.metrics_token')
+        header = request.httprequest.headers.get('Authorization', '')
+        given = token or (header[7:] if header.startswith('Bearer ') else '')
+        if not request.session.uid and not (expected and given and consteq(expected, given)):
+            return Response('Forbidden', status=403, content_type='text/plain')
+        
+        groups = env['stock.location'].read_group(
+            [('occupancy_layout_id', '!=', False), ('active', '=', True)],
+            ['occupancy_layout_id', 'occupancy_status'],
+            ['occupancy_layout_id', 'occupancy_status'], lazy=False)
+        gauges = [
+            ('occupancy_locations', "Tracked locations by layout and status", [
+                ({'layout': group['occupancy_layout_id'][1], 'status': group['occupancy_status']},
+                 group['__count'])
+                for group in groups
+            ]),
+            ('occupancy_version', "Current occupancy version (change watermark)", [
+                ({}, env['stock.location']._get_occupancy_version()),
+            ]),
+            ('occupancy_grid_snapshots', "Grid snapshots cached in this process", [
+                ({}, len(_grid_snapshots)),
+            ]),
+        ]
+        return request.make_response(
+            metrics.render(gauges),
+            [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
+
+    def _get_grid_data_as_of(self, layout, as_of, row_offset, row_limit, levels):
+        """
+        Grid of layout replayed at as_of, never cached: each frame is
+        one checkpoint read plus the transitions logged since
+        """
+        as_of = fields.Datetime.to_datetime(as_of)
+        replay_start = request.env['location.occupancy.history']._get_replay_start()
+        if as_of < replay_start:
+            return self._error_response(
+                f"Occupancy history before {fields.Datetime.to_string(replay_start)} is compacted")
+        if as_of >= fields.Datetime.now():
+            return self._error_response("Cannot replay the occupancy grid in the future")
+        
+        with metrics.timed('grid_replay'):
+            response = layout._build_grid_data(as_of=as_of)
+        response.update(version=None, as_of=fields.Datetime.to_string(as_of))
+        if row_offset is None and row_limit is None and levels is None:
+            return response
+        # The client has no other source for the replayed summary
+        return dict(self._window_response(response, row_offset, row_limit, levels),
+                    as_of=response['as_of'], summary=response['summary'])
+
+    def _window_response(self, response, row_offset, row_limit, levels):
+        """Slice a full grid response down to the requested rows/levels"""
+        rows = response['rows']
+        start = max(int(row_offset or 0), 0)
+        end = len(rows) if row_limit is None else start + max(int(row_limit), 0)
+        
+        window_rows = rows[start:end]
+        if levels:
+            window_rows = [
+                dict(row, levels=[level for level in row['levels'] if level['name'] in levels])
+                for row in window_rows
+            ]
+        
+        return {
+            'success': True,
+            'version': response['version'],
+            'layout': response['layout'],
+            'layouts': response['layouts'],
+            'row_offset': start,
+            'row_index': [{
+                'index': index,
+                'name': row['name'],
+                'label': row['label'],
+                'emoji': row['emoji'],
+                'count': row['count'],
+                'level_count': len(row['levels']),
+                'column_numbers': row['column_numbers'],
+            } for index, row in enumerate(rows)],
+            'rows': window_rows,
+        }
+
+    def _next_poll_hint(self):
+        """Fallback poll interval (seconds) suggested to grid clients"""
+        param = request.env['ir.config_parameter'].sudo().get_param(
+            'personalizirai_location_occupancy.poll_interval')
+        return int(param) if param else DEFAULT_POLL_INTERVAL
+
+    def _error_response(self, message):
+        return {
+            'success': False,
+            'error': message,
+            'summary': {'total': 0, 'free': 0, 'reserved': 0, 'occupied': 0},
+            'rows': []
+        }
+
+    def _get_layout(self, layout_id=None):
+        """Requested layout, or the first one"""
+        Layout = request.env['location.occupancy.layout']
+        if layout_id:
+            return Layout.browse(int(layout_id)).exists()
+        return Layout.search([], limit=1)
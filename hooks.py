@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+from odoo import api, SUPERUSER_ID
+
+
+def post_init_hook(cr, registry):
+    """Fill the stored occupancy fields for existing orders"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['stock.location']._backfill_occupancy()
@@ -1,2 +1,6 @@
 # -*- coding: utf-8 -*-
+from . import location_occupancy_layout
 from . import stock_location
+from . import sale_order
+from . import location_occupancy_history
+from . import location_occupancy_snapshot
@@ -0,0 +1,560 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools
+from odoo.tools import sql
+from datetime import datetime, timedelta
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+OCCUPANCY_STATUS_SELECTION = [
+    ('free', 'Free'),
+    ('reserved', 'Reserved'),
+    ('occupied', 'Occupied'),
+]
+
+# Raw events older than this are folded into daily rollups
+DEFAULT_RETENTION_DAYS = 120
+
+# Hourly rollups are kept this long (longest heatmap window)
+HOURLY_RETENTION_DAYS = 90
+
+# Hours already rolled up that are recomputed on each run, to include
+# transitions committed late by long transactions
+HOURLY_REFRESH_LAG = timedelta(hours=1)
+
+# Transitions logged this long before a checkpoint are replayed on top of
+# it, to include those committed after the checkpoint read the locations
+CHECKPOINT_REPLAY_MARGIN = timedelta(minutes=5)
+
+
+class LocationOccupancyHistory(models.Model):
+    """
+    Append-only log of location occupancy transitions.
+
+    One row per status/order change, written by stock.location
+    _refresh_occupancy. Old rows are folded into
+    location.occupancy.history.daily by _cron_compact_history.
+    """
+    _name = 'location.occupancy.history'
+    _description = 'Location Occupancy History'
+    _order = 'timestamp desc, id desc'
+    _log_access = False
+
+    location_id = fields.Many2one(
+        'stock.location',
+        string='Location',
+        required=True,
+        readonly=True,
+        ondelete='cascade')
+
+    order_id = fields.Many2one(
+        'sale.order',
+        string='Order',
+        readonly=True,
+        ondelete='set null')
+
+    from_status = fields.Selection(
+        OCCUPANCY_STATUS_SELECTION,
+        string='From',
+        required=True,
+        readonly=True)
+
+    to_status = fields.Selection(
+        OCCUPANCY_STATUS_SELECTION,
+        string='To',
+        required=True,
+        readonly=True)
+
+    timestamp = fields.Datetime(
+        string='Timestamp',
+        required=True,
+        readonly=True,
+        default=fields.Datetime.now)
+
+    def init(self):
+        # Every read is a per-location time range
+        sql.create_index(
+            self.env.cr, 'location_occupancy_history_location_timestamp_idx',
+            self._table, ['location_id', 'timestamp'])
+        sql.create_index(
+            self.env.cr, 'location_occupancy_history_timestamp_idx',
+            self._table, ['timestamp'])
+
+    @api.model
+    def _log_transitions(self, vals_list):
+        """Append many transitions in a single INSERT"""
+        self.env.cr.execute("""
+            INSERT INTO location_occupancy_history
+                   (location_id, order_id, from_status, to_status, timestamp)
+            SELECT * FROM unnest(%s::int[], %s::int[], %s::varchar[], %s::varchar[], %s::timestamp[])
+        """, [
+            [vals['location_id'] for vals in vals_list],
+            [vals['order_id'] or None for vals in vals_list],
+            [vals['from_status'] for vals in vals_list],
+            [vals['to_status'] for vals in vals_list],
+            [vals['timestamp'] for vals in vals_list],
+        ])
+
+    @api.model
+    def _get_retention_days(self):
+        param = self.env['ir.config_parameter'].sudo().get_param(
+            'personalizirai_location_occupancy.history_retention_days')
+        return int(param) if param else DEFAULT_RETENTION_DAYS
+
+    @api.model
+    def _get_location_stats(self, location_ids, days=7):
+        """
+        7-day statistics for many locations in one SQL statement.
+
+        Returns {location_id: {busy_seconds, uses, stints, last_freed, last_order}}.
+        Spans are clipped to the window; the last event before the window
+        (anchor) provides the status the location was in when it started.
+        """
+        if not location_ids:
+            return {}
+
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            WITH anchor AS (
+                SELECT DISTINCT ON (location_id)
+                       id, location_id, from_status, to_status, timestamp, TRUE AS is_anchor
+                  FROM location_occupancy_history
+                 WHERE location_id = ANY(%(ids)s) AND timestamp < %(start)s
+              ORDER BY location_id, timestamp DESC, id DESC
+            ), events AS (
+                SELECT * FROM anchor
+                 UNION ALL
+                SELECT id, location_id, from_status, to_status, timestamp, FALSE
+                  FROM location_occupancy_history
+                 WHERE location_id = ANY(%(ids)s) AND timestamp >= %(start)s
+            ), spans AS (
+                SELECT location_id, from_status, to_status, timestamp, is_anchor,
+                       GREATEST(timestamp, %(start)s) AS span_start,
+                       LEAD(timestamp, 1, %(now)s) OVER (
+                           PARTITION BY location_id ORDER BY timestamp, id) AS span_end
+                  FROM events
+            ), stats AS (
+                SELECT location_id,
+                       SUM(EXTRACT(EPOCH FROM span_end - span_start))
+                           FILTER (WHERE to_status != 'free') AS busy_seconds,
+                       COUNT(*) FILTER (WHERE NOT is_anchor
+                                          AND from_status = 'free'
+                                          AND to_status != 'free') AS uses,
+                       COUNT(*) FILTER (WHERE to_status != 'free'
+                                          AND (is_anchor OR from_status = 'free')) AS stints
+                  FROM spans
+              GROUP BY location_id
+            )
+            SELECT l.id, s.busy_seconds, s.uses, s.stints, lf.last_freed, so.name
+              FROM unnest(%(ids)s) AS l(id)
+         LEFT JOIN stats s ON s.location_id = l.id
+         LEFT JOIN LATERAL (
+                SELECT MAX(h.timestamp) AS last_freed
+                  FROM location_occupancy_history h
+                 WHERE h.location_id = l.id AND h.to_status = 'free'
+             ) lf ON TRUE
+         LEFT JOIN LATERAL (
+                SELECT h.order_id
+                  FROM location_occupancy_history h
+                 WHERE h.location_id = l.id AND h.order_id IS NOT NULL
+              ORDER BY h.timestamp DESC, h.id DESC
+                 LIMIT 1
+             ) lo ON TRUE
+         LEFT JOIN sale_order so ON so.id = lo.order_id
+        """, {
+            'ids': list(location_ids),
+            'start': now - timedelta(days=days),
+            'now': now,
+        })
+        return {
+            location_id: {
+                'busy_seconds': busy_seconds or 0.0,
+                'uses': uses or 0,
+                'stints': stints or 0,
+                'last_freed': last_freed,
+                'last_order': last_order,
+            }
+            for location_id, busy_seconds, uses, stints, last_freed, last_order
+            in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _cron_compact_history(self):
+        """
+        Fold events older than the retention period into daily rollups.
+
+        Spans are split per day and added to the rollup table. The latest
+        event of each location before the cutoff is kept as an anchor so
+        current status and 7-day statistics stay exact; the part of its span
+        already folded is skipped next time via the stored watermark.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        watermark_key = 'personalizirai_location_occupancy.history_compacted_until'
+        cutoff = fields.Datetime.now() - timedelta(days=self._get_retention_days())
+        watermark = fields.Datetime.to_datetime(ICP.get_param(watermark_key)) or datetime(1970, 1, 1)
+        if cutoff <= watermark:
+            return True
+
+        params = {'cutoff': cutoff, 'watermark': watermark}
+        self.env.cr.execute("""
+            WITH spans AS (
+                SELECT location_id, from_status, to_status, timestamp,
+                       GREATEST(timestamp, %(watermark)s) AS span_start,
+                       LEAST(COALESCE(LEAD(timestamp) OVER (
+                           PARTITION BY location_id ORDER BY timestamp, id), %(cutoff)s),
+                           %(cutoff)s) AS span_end
+                  FROM location_occupancy_history
+                 WHERE timestamp < %(cutoff)s
+            ), per_day AS (
+                SELECT s.location_id,
+                       d::date AS day,
+                       SUM(EXTRACT(EPOCH FROM LEAST(s.span_end, d + INTERVAL '1 day')
+                                             - GREATEST(s.span_start, d)))
+                           FILTER (WHERE s.to_status = 'occupied') AS occupied_seconds,
+                       SUM(EXTRACT(EPOCH FROM LEAST(s.span_end, d + INTERVAL '1 day')
+                                             - GREATEST(s.span_start, d)))
+                           FILTER (WHERE s.to_status = 'reserved') AS reserved_seconds,
+                       COUNT(*) FILTER (WHERE s.timestamp >= d
+                                          AND s.timestamp >= %(watermark)s
+                                          AND s.timestamp < d + INTERVAL '1 day') AS transitions,
+                       COUNT(*) FILTER (WHERE s.timestamp >= d
+                                          AND s.timestamp >= %(watermark)s
+                                          AND s.timestamp < d + INTERVAL '1 day'
+                                          AND s.from_status = 'free'
+                                          AND s.to_status != 'free') AS times_used
+                  FROM spans s,
+                       generate_series(date_trunc('day', s.span_start),
+                                       s.span_end, INTERVAL '1 day') AS d
+                 WHERE s.span_end > s.span_start
+              GROUP BY s.location_id, d
+            )
+            INSERT INTO location_occupancy_history_daily
+                   (location_id, day, occupied_seconds, reserved_seconds, transitions, times_used)
+            SELECT location_id, day, COALESCE(occupied_seconds, 0), COALESCE(reserved_seconds, 0),
+                   transitions, times_used
+              FROM per_day
+            ON CONFLICT (location_id, day) DO UPDATE SET
+                   occupied_seconds = location_occupancy_history_daily.occupied_seconds + EXCLUDED.occupied_seconds,
+                   reserved_seconds = location_occupancy_history_daily.reserved_seconds + EXCLUDED.reserved_seconds,
+                   transitions = location_occupancy_history_daily.transitions + EXCLUDED.transitions,
+                   times_used = location_occupancy_history_daily.times_used + EXCLUDED.times_used
+        """, params)
+
+        # Drop folded events, keeping the latest one per location as anchor
+        self.env.cr.execute("""
+            DELETE FROM location_occupancy_history h
+             WHERE h.timestamp < %(cutoff)s
+               AND EXISTS (
+                    SELECT 1 FROM location_occupancy_history newer
+                     WHERE newer.location_id = h.location_id
+                       AND newer.timestamp < %(cutoff)s
+                       AND (newer.timestamp, newer.id) > (h.timestamp, h.id)
+               )
+        """, params)
+        _logger.info(f"Compacted {self.env.cr.rowcount} occupancy history events older than {cutoff}")
+
+        ICP.set_param(watermark_key, fields.Datetime.to_string(cutoff))
+        return True
+
+
+    @api.model
+    def _cron_refresh_hourly(self):
+        """
+        Refresh location.occupancy.history.hourly up to the last full hour.
+
+        Only buckets after the stored watermark (minus HOURLY_REFRESH_LAG)
+        are recomputed, from the events in that range plus the last event
+        of each tracked location before it (its status at the start).
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        watermark_key = 'personalizirai_location_occupancy.hourly_rolled_until'
+        end = fields.Datetime.now().replace(minute=0, second=0, microsecond=0)
+        watermark = fields.Datetime.to_datetime(ICP.get_param(watermark_key))
+        start = max(watermark - HOURLY_REFRESH_LAG if watermark else datetime(1970, 1, 1),
+                    end - timedelta(days=HOURLY_RETENTION_DAYS))
+        if start >= end:
+            return True
+
+        params = {'start': start, 'end': end}
+        self.env.cr.execute("""
+            DELETE FROM location_occupancy_history_hourly
+             WHERE hour >= %(start)s OR hour < %(start)s - make_interval(days => %(retention)s)
+        """, dict(params, retention=HOURLY_RETENTION_DAYS))
+        self.env.cr.execute("""
+            WITH events AS (
+                SELECT l.id AS location_id, a.to_status, a.timestamp, a.id
+                  FROM stock_location l
+            CROSS JOIN LATERAL (
+                    SELECT h.to_status, h.timestamp, h.id
+                      FROM location_occupancy_history h
+                     WHERE h.location_id = l.id AND h.timestamp < %(start)s
+                  ORDER BY h.timestamp DESC, h.id DESC
+                     LIMIT 1
+                   ) a
+                 WHERE l.occupancy_layout_id IS NOT NULL
+                 UNION ALL
+                SELECT location_id, to_status, timestamp, id
+                  FROM location_occupancy_history
+                 WHERE timestamp >= %(start)s AND timestamp < %(end)s
+            ), spans AS (
+                SELECT location_id, to_status,
+                       GREATEST(timestamp, %(start)s) AS span_start,
+                       LEAD(timestamp, 1, %(end)s) OVER (
+                           PARTITION BY location_id ORDER BY timestamp, id) AS span_end
+                  FROM events
+            )
+            INSERT INTO location_occupancy_history_hourly
+                   (location_id, hour, occupied_seconds, reserved_seconds)
+            SELECT s.location_id, b.hour,
+                   COALESCE(SUM(EXTRACT(EPOCH FROM LEAST(s.span_end, b.hour + INTERVAL '1 hour')
+                                                 - GREATEST(s.span_start, b.hour)))
+                       FILTER (WHERE s.to_status = 'occupied'), 0),
+                   COALESCE(SUM(EXTRACT(EPOCH FROM LEAST(s.span_end, b.hour + INTERVAL '1 hour')
+                                                 - GREATEST(s.span_start, b.hour)))
+                       FILTER (WHERE s.to_status = 'reserved'), 0)
+              FROM spans s,
+                   generate_series(date_trunc('hour', s.span_start),
+                                   s.span_end - INTERVAL '1 microsecond',
+                                   INTERVAL '1 hour') AS b(hour)
+             WHERE s.span_end > s.span_start AND s.to_status != 'free'
+          GROUP BY s.location_id, b.hour
+        """, params)
+        _logger.info(f"Rolled up {self.env.cr.rowcount} hourly occupancy buckets from {start} to {end}")
+
+        ICP.set_param(watermark_key, fields.Datetime.to_string(end))
+        return True
+
+    @api.model
+    def _get_heatmap(self, layout, days=30):
+        """
+        Share of time each cell of layout was busy over the last days,
+        read from the hourly rollups, plus averages per row/level and
+        per row/column, in one query (GROUPING SETS).
+
+        Returns {'cells': {id: {busy, occupied}}, 'levels': {'A-E': busy},
+        'columns': {'A-05': busy}}; shares are 0..1.
+        """
+        since = fields.Datetime.now() - timedelta(days=days)
+        self.env.cr.execute("""
+            SELECT GROUPING(l.id), GROUPING(l.occupancy_level),
+                   l.id, l.occupancy_row, l.occupancy_level, l.occupancy_column_label,
+                   AVG(COALESCE(r.busy, 0)) / %(window)s,
+                   AVG(COALESCE(r.occupied, 0)) / %(window)s
+              FROM stock_location l
+         LEFT JOIN (
+                    SELECT location_id,
+                           SUM(occupied_seconds + reserved_seconds) AS busy,
+                           SUM(occupied_seconds) AS occupied
+                      FROM location_occupancy_history_hourly
+                     WHERE hour >= %(since)s
+                  GROUP BY location_id
+                   ) r ON r.location_id = l.id
+             WHERE l.occupancy_layout_id = %(layout)s AND l.active AND l.usage = 'internal'
+          GROUP BY GROUPING SETS (
+                    (l.id, l.occupancy_row, l.occupancy_level, l.occupancy_column_label),
+                    (l.occupancy_row, l.occupancy_level),
+                    (l.occupancy_row, l.occupancy_column_label)
+                   )
+        """, {'since': since, 'window': days * 86400.0, 'layout': layout.id})
+
+        heatmap = {'cells': {}, 'levels': {}, 'columns': {}}
+        for (no_cell, no_level, location_id, row, level, column_label,
+                busy, occupied) in self.env.cr.fetchall():
+            if not no_cell:
+                heatmap['cells'][location_id] = {
+                    'busy': round(min(busy, 1.0), 3),
+                    'occupied': round(min(occupied, 1.0), 3),
+                }
+            elif not no_level:
+                heatmap['levels'][f'{row}-{level}'] = round(min(busy, 1.0), 3)
+            else:
+                heatmap['columns'][f'{row}-{column_label}'] = round(min(busy, 1.0), 3)
+        return heatmap
+
+    @api.model
+    def _get_replay_start(self):
+        """Earliest moment the grid can be replayed at: older events are compacted"""
+        return fields.Datetime.now() - timedelta(days=self._get_retention_days())
+
+    @api.model
+    def _get_occupancy_as_of(self, location_ids, as_of):
+        """
+        Status of many locations at as_of, replayed from the transition log.
+
+        Starts from the nearest checkpoint at or before as_of and applies,
+        in order, only the transitions logged since (see
+        CHECKPOINT_REPLAY_MARGIN). Without a checkpoint, the last
+        transition of each location before as_of is looked up instead,
+        together with the start of its stint.
+
+        Returns {location_id: (status, order_id, since)} of the locations
+        that were not free.
+        """
+        if not location_ids:
+            return {}
+
+        params = {'ids': list(location_ids), 'as_of': as_of}
+        checkpoint = self.env['location.occupancy.checkpoint'].search(
+            [('taken_at', '<=', as_of)], order='taken_at desc', limit=1)
+        if checkpoint:
+            # Copy: the checkpoint state is cached
+            state = dict(checkpoint._get_state(checkpoint.id))
+            # Every transition of the window, so stints keep their start
+            self.env.cr.execute("""
+                SELECT location_id, from_status, to_status, order_id, timestamp
+                  FROM location_occupancy_history
+                 WHERE timestamp > %(start)s AND timestamp <= %(as_of)s
+                   AND location_id = ANY(%(ids)s)
+              ORDER BY timestamp, id
+            """, dict(params, start=checkpoint.taken_at - CHECKPOINT_REPLAY_MARGIN))
+        else:
+            state = {}
+            # One row per location: its last transition, dated at the start
+            # of the stint (first transition since it was last free or held
+            # by another order)
+            self.env.cr.execute("""
+                SELECT l.id, a.from_status, a.to_status, a.order_id,
+                       COALESCE(stint.since, a.timestamp)
+                  FROM unnest(%(ids)s) AS l(id)
+            CROSS JOIN LATERAL (
+                    SELECT h.from_status, h.to_status, h.order_id, h.timestamp
+                      FROM location_occupancy_history h
+                     WHERE h.location_id = l.id AND h.timestamp <= %(as_of)s
+                  ORDER BY h.timestamp DESC, h.id DESC
+                     LIMIT 1
+                   ) a
+            CROSS JOIN LATERAL (
+                    SELECT MIN(h.timestamp) AS since
+                      FROM location_occupancy_history h
+                     WHERE h.location_id = l.id AND h.timestamp <= %(as_of)s
+                       AND h.timestamp > COALESCE((
+                            SELECT MAX(b.timestamp)
+                              FROM location_occupancy_history b
+                             WHERE b.location_id = l.id AND b.timestamp <= %(as_of)s
+                               AND (b.to_status = 'free' OR b.order_id IS DISTINCT FROM a.order_id)
+                           ), '-infinity')
+                   ) stint
+            """, params)
+
+        for location_id, from_status, to_status, order_id, timestamp in self.env.cr.fetchall():
+            if to_status == 'free':
+                state.pop(location_id, None)
+                continue
+            previous = state.get(location_id)
+            if from_status != 'free' and previous and previous[1] == order_id:
+                # Same stint (e.g. reserved → occupied): it started earlier
+                since = previous[2]
+            else:
+                since = timestamp
+            state[location_id] = (to_status, order_id, since)
+
+        location_ids = set(location_ids)
+        return {location_id: value for location_id, value in state.items() if location_id in location_ids}
+
+
+class LocationOccupancyHistoryHourly(models.Model):
+    """Hourly busy time per location, refreshed by _cron_refresh_hourly"""
+    _name = 'location.occupancy.history.hourly'
+    _description = 'Location Occupancy Hourly Rollup'
+    _order = 'hour desc, location_id'
+    _log_access = False
+
+    location_id = fields.Many2one(
+        'stock.location',
+        string='Location',
+        required=True,
+        readonly=True,
+        ondelete='cascade')
+
+    hour = fields.Datetime(string='Hour', required=True, readonly=True, index=True)
+    occupied_seconds = fields.Float(string='Occupied (s)', readonly=True)
+    reserved_seconds = fields.Float(string='Reserved (s)', readonly=True)
+
+    _sql_constraints = [
+        ('location_hour_uniq', 'unique(location_id, hour)',
+         'Only one rollup per location and hour.'),
+    ]
+
+
+class LocationOccupancyCheckpoint(models.Model):
+    """
+    Compact status of every busy tracked location at one moment.
+
+    Taken by _cron_take_checkpoint, so that replaying the grid at a past
+    moment only reads the transitions logged since the nearest checkpoint
+    (see location.occupancy.history._get_occupancy_as_of).
+    """
+    _name = 'location.occupancy.checkpoint'
+    _description = 'Location Occupancy Checkpoint'
+    _order = 'taken_at desc'
+    _log_access = False
+
+    taken_at = fields.Datetime(string='Taken At', required=True, readonly=True, index=True)
+    payload = fields.Text(
+        string='Payload',
+        readonly=True,
+        help="JSON {location_id: [status, order_id, since]} of the locations that were not free")
+
+    @api.model
+    @tools.ormcache('checkpoint_id')
+    def _get_state(self, checkpoint_id):
+        """
+        Decoded payload: {location_id: (status, order_id, since)}.
+
+        Checkpoints never change, so the result is cached per worker.
+        Do not modify the returned dict.
+        """
+        payload = json.loads(self.browse(checkpoint_id).payload or '{}')
+        return {
+            int(location_id): (status, order_id, fields.Datetime.to_datetime(since))
+            for location_id, (status, order_id, since) in payload.items()
+        }
+
+    @api.model
+    def _cron_take_checkpoint(self):
+        """Store the current status of the busy tracked locations, drop old checkpoints"""
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            SELECT id, occupancy_status, occupancy_order_id, occupancy_since
+              FROM stock_location
+             WHERE occupancy_layout_id IS NOT NULL AND occupancy_status != 'free'
+        """)
+        payload = {
+            location_id: [status, order_id, fields.Datetime.to_string(since) if since else None]
+            for location_id, status, order_id, since in self.env.cr.fetchall()
+        }
+        self.create({'taken_at': now, 'payload': json.dumps(payload, separators=(',', ':'))})
+
+        # Transitions before the replay start are compacted: these can no longer be replayed
+        expired = self.search([('taken_at', '<', self.env['location.occupancy.history']._get_replay_start())])
+        expired.unlink()
+        _logger.info(f"Occupancy checkpoint taken: {len(payload)} busy locations, {len(expired)} expired")
+        return True
+
+
+class LocationOccupancyHistoryDaily(models.Model):
+    """Daily rollup of compacted occupancy history"""
+    _name = 'location.occupancy.history.daily'
+    _description = 'Location Occupancy Daily Rollup'
+    _order = 'day desc, location_id'
+    _log_access = False
+
+    location_id = fields.Many2one(
+        'stock.location',
+        string='Location',
+        required=True,
+        readonly=True,
+        index=True,
+        ondelete='cascade')
+
+    day = fields.Date(string='Day', required=True, readonly=True)
+    occupied_seconds = fields.Float(string='Occupied (s)', readonly=True)
+    reserved_seconds = fields.Float(string='Reserved (s)', readonly=True)
+    transitions = fields.Integer(string='Transitions', readonly=True)
+    times_used = fields.Integer(string='Times Used', readonly=True)
+
+    _sql_constraints = [
+        ('location_day_uniq', 'unique(location_id, day)',
+         'Only one rollup per location and day.'),
+    ]
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+from itertools import groupby
+import logging
+
+from ..tools import metrics
+
+_logger = logging.getLogger(__name__)
+
+# PR-1 warehouse root location, used for the default layout
+PR1_LOCATION_ID = 19
+
+# stock.location fields needed to render one grid cell
+GRID_LOCATION_FIELDS = [
+    'id', 'name', 'barcode',
+    'occupancy_status',
+    'occupancy_order_name',
+    'occupancy_customer',
+    'occupancy_duration_hours',
+    'occupancy_transport_unit',  # Transport box info
+    'occupancy_row',
+    'occupancy_level',
+    'occupancy_column',
+    'occupancy_column_label',
+    'pr1_zone'
+]
+
+# Extra fields shown in the details modal, fetched one location at a time
+DETAIL_LOCATION_FIELDS = GRID_LOCATION_FIELDS + [
+    'occupancy_magento_id',
+    'occupancy_since',
+    'occupancy_rate_7d',
+    'occupancy_times_used_7d',
+    'occupancy_last_freed',
+]
+
+# Status codes of the packed grid format (index = code)
+PACKED_STATUSES = ['free', 'reserved', 'occupied']
+
+# Physical order of cells, served by the layout position index
+GRID_ORDER = ('occupancy_row_seq, occupancy_row, occupancy_level_seq, '
+              'occupancy_level, occupancy_column, id')
+
+
+class LocationOccupancyLayout(models.Model):
+    """
+    Physical grid layout of one warehouse root.
+
+    Direct children of root_location_id are tracked and placed on the grid
+    by parsing their name (Row<sep>Level<sep>Column, e.g. A-E-05) once,
+    when the location or the layout changes. The result is stored on
+    stock.location (occupancy_row/level/column and their sequences).
+    """
+    _name = 'location.occupancy.layout'
+    _description = 'Location Occupancy Layout'
+    _order = 'sequence, id'
+
+    name = fields.Char(string='Name', required=True)
+    sequence = fields.Integer(string='Sequence', default=10)
+    active = fields.Boolean(string='Active', default=True)
+
+    root_location_id = fields.Many2one(
+        'stock.location',
+        string='Warehouse Root',
+        required=True,
+        ondelete='cascade',
+        help="Locations directly under this one are shown on the grid")
+
+    row_order = fields.Char(
+        string='Rows',
+        required=True,
+        default='A,B',
+        help="Comma separated rows, in display order")
+
+    level_order = fields.Char(
+        string='Levels',
+        required=True,
+        default='E,D,C,B,A',
+        help="Comma separated levels, top to bottom")
+
+    separator = fields.Char(
+        string='Name Separator',
+        required=True,
+        default='-',
+        help="Separator between row, level and column in location names")
+
+    location_ids = fields.One2many(
+        'stock.location', 'occupancy_layout_id',
+        string='Locations')
+
+    _sql_constraints = [
+        ('root_location_uniq', 'unique(root_location_id)',
+         'A warehouse root can only have one occupancy layout.'),
+    ]
+
+    @api.constrains('separator')
+    def _check_separator(self):
+        for layout in self:
+            if not layout.separator.strip():
+                raise ValidationError(_("The name separator cannot be blank."))
+
+    # ============================================
+    # LAYOUT PARSING
+    # ============================================
+
+    def _get_rows(self):
+        self.ensure_one()
+        return [r.strip() for r in (self.row_order or '').split(',') if r.strip()]
+
+    def _get_levels(self):
+        self.ensure_one()
+        return [l.strip() for l in (self.level_order or '').split(',') if l.strip()]
+
+    def _get_level_label(self, level):
+        """Ниво E (Горе) ... Ниво A (Долу) for the configured top/bottom"""
+        self.ensure_one()
+        levels = self._get_levels()
+        if levels and level == levels[0]:
+            return f'Ниво {level} (Горе)'
+        if levels and level == levels[-1]:
+            return f'Ниво {level} (Долу)'
+        return f'Ниво {level}'
+
+    def _parse_location_name(self, name):
+        """
+        Parse 'A-E-05' into stored layout values.
+
+        Returns a dict of stock.location layout fields, or None when the
+        name does not follow Row-Level-Column.
+        """
+        self.ensure_one()
+        parts = (name or '').split(self.separator)
+        if len(parts) < 3 or not parts[2].isdigit():
+            return None
+
+        row, level, column_label = parts[0], parts[1], parts[2]
+        rows = self._get_rows()
+        levels = self._get_levels()
+        return {
+            'occupancy_row': row,
+            'occupancy_level': level,
+            'occupancy_column': int(column_label),
+            'occupancy_column_label': column_label,
+            # Unlisted rows/levels sort after the configured ones
+            'occupancy_row_seq': rows.index(row) if row in rows else len(rows),
+            'occupancy_level_seq': levels.index(level) if level in levels else len(levels),
+        }
+
+    # ============================================
+    # GRID
+    # ============================================
+
+    def _grid_domain(self):
+        """Domain of the locations shown on the grid"""
+        self.ensure_one()
+        return [
+            ('occupancy_layout_id', '=', self.id),
+            ('usage', '=', 'internal'),
+            ('active', '=', True),
+        ]
+
+    def _grid_summary(self):
+        """Status counters computed in SQL on the stored status column"""
+        summary = {'total': 0, 'free': 0, 'reserved': 0, 'occupied': 0}
+        groups = self.env['stock.location'].read_group(
+            self._grid_domain(), ['occupancy_status'], ['occupancy_status'])
+        for group in groups:
+            count = group['occupancy_status_count']
+            summary['total'] += count
+            if group['occupancy_status'] in summary:
+                summary[group['occupancy_status']] += count
+        return summary
+
+    @metrics.timed('grid_build')
+    def _build_grid_data(self, as_of=None):
+        """
+        Build the full grid response from the stored layout index
+
+        Locations arrive already ordered by row, level and column, so
+        rows and levels are grouped in a single pass.
+
+        With as_of, cells show the status the locations had at that
+        moment (see _replay_grid_cells); placement is the current one.
+        """
+        self.ensure_one()
+        Location = self.env['stock.location']
+        domain = self._grid_domain()
+
+        # Read all data in batch, in physical order
+        location_data = Location.search_read(domain, GRID_LOCATION_FIELDS, order=GRID_ORDER)
+        if as_of:
+            self._replay_grid_cells(location_data, as_of)
+
+        _logger.debug(f"📦 Found {len(location_data)} {self.name} locations")
+
+        # Widest column per row, for the column number headers
+        max_columns = {
+            group['occupancy_row']: group['occupancy_column'] or 0
+            for group in Location.read_group(
+                domain, ['occupancy_row', 'occupancy_column:max'], ['occupancy_row'])
+        }
+
+        # Initialize summary counters
+        summary = {
+            'total': len(location_data),
+            'free': 0,
+            'reserved': 0,
+            'occupied': 0
+        }
+
+        layout_levels = self._get_levels()
+        rows = []
+        for row_name, row_locations in groupby(location_data, key=lambda l: l['occupancy_row']):
+            # Level order: configured (E top → A bottom), then any others
+            levels_data = {level_name: [] for level_name in layout_levels}
+            for level_name, level_locations in groupby(row_locations, key=lambda l: l['occupancy_level']):
+                cells = levels_data.setdefault(level_name, [])
+                for loc in level_locations:
+                    if loc['occupancy_status'] in summary:
+                        summary[loc['occupancy_status']] += 1
+                    cells.append(self._format_grid_cell(loc))
+
+            levels = [{
+                'name': level_name,
+                'label': self._get_level_label(level_name),
+                'count': len(cells),
+                'locations': cells
+            } for level_name, cells in levels_data.items()]
+
+            rows.append({
+                'name': row_name,
+                'label': f'РЕДИЦА {row_name}',
+                'emoji': '📦',
+                'count': sum(level['count'] for level in levels),
+                'column_numbers': [f"{i:02d}" for i in range(1, max_columns.get(row_name, 0) + 1)],
+                'levels': levels
+            })
+
+        response = {
+            'success': True,
+            'layout': {'id': self.id, 'name': self.name},
+            'layouts': [
+                {'id': l.id, 'name': l.name}
+                for l in self.search([])
+            ],
+            'summary': summary,
+            'rows': rows
+        }
+
+        _logger.debug(f"✅ Grid data prepared: {summary}")
+        for row in rows:
+            _logger.debug(f"   Row {row['name']}: {row['count']} locations, {len(row['column_numbers'])} columns")
+
+        return response
+
+    def _replay_grid_cells(self, location_data, as_of):
+        """
+        Overwrite the status fields of location_data (as read with
+        GRID_LOCATION_FIELDS) with the values replayed at as_of.
+
+        The transport box is not logged, so it is left empty.
+        """
+        state = self.env['location.occupancy.history']._get_occupancy_as_of(
+            [loc['id'] for loc in location_data], as_of)
+        orders = self.env['sale.order'].sudo().browse(
+            {order_id for _status, order_id, _since in state.values() if order_id}).exists()
+        order_names = {order.id: (order.name, order.partner_id.name or 'Unknown') for order in orders}
+
+        for loc in location_data:
+            status, order_id, since = state.get(loc['id'], ('free', None, None))
+            order_name, customer = order_names.get(order_id, (False, False))
+            loc.update({
+                'occupancy_status': status,
+                'occupancy_order_name': order_name,
+                'occupancy_customer': customer,
+                'occupancy_duration_hours': (as_of - since).total_seconds() / 3600 if since else 0.0,
+                'occupancy_transport_unit': False,
+            })
+
+    def _read_grid_cells(self, locations):
+        """Grid cells of the given locations, in id order"""
+        return [self._format_grid_cell(loc) for loc in locations.read(GRID_LOCATION_FIELDS)]
+
+    def _format_grid_cell(self, loc):
+        """Format one location (as read with GRID_LOCATION_FIELDS) for the frontend"""
+        return {
+            'id': loc['id'],
+            'name': loc['name'],
+            'display_name': f"{loc['occupancy_row']}-{loc['occupancy_level']}-{loc['occupancy_column_label']}",
+            'row': loc['occupancy_row'],
+            'level': loc['occupancy_level'],
+            'column': loc['occupancy_column'],
+            'column_label': loc['occupancy_column_label'],  # "01", "02" with leading zeros
+            'status': loc['occupancy_status'],
+            'order': loc['occupancy_order_name'] or None,
+            'customer': loc['occupancy_customer'] or None,
+            'duration': round((loc['occupancy_duration_hours'] or 0) / 24, 1),
+            'transport_unit': loc['occupancy_transport_unit'] or None
+        }
+
+    @api.model
+    def _pack_rows(self, rows):
+        """
+        Columnar form of grid rows for the packed wire format.
+
+        Each level carries parallel arrays instead of one object per cell:
+        ids, columns, status codes (index into PACKED_STATUSES) and indexes
+        into a shared string table for column labels and order names (-1
+        when empty). Customer and transport details are left out; the
+        client fetches them per location when the modal opens.
+        """
+        strings = []
+        string_index = {}
+
+        def encode(value):
+            if not value:
+                return -1
+            if value not in string_index:
+                string_index[value] = len(strings)
+                strings.append(value)
+            return string_index[value]
+
+        status_codes = {status: code for code, status in enumerate(PACKED_STATUSES)}
+        packed_rows = []
+        for row in rows:
+            levels = []
+            for level in row['levels']:
+                cells = level['locations']
+                levels.append({
+                    'name': level['name'],
+                    'label': level['label'],
+                    'count': level['count'],
+                    'ids': [cell['id'] for cell in cells],
+                    'columns': [cell['column'] for cell in cells],
+                    'labels': [encode(cell['column_label']) for cell in cells],
+                    'status': [status_codes.get(cell['status'], 0) for cell in cells],
+                    'orders': [encode(cell['order']) for cell in cells],
+                })
+            packed_rows.append(dict(row, levels=levels))
+        return {
+            'format': 'packed',
+            'statuses': PACKED_STATUSES,
+            'strings': strings,
+            'rows': packed_rows,
+        }
+
+    def _get_location_details(self, location):
+        """Full details of one grid location for the details modal"""
+        self.ensure_one()
+        loc = location.read(DETAIL_LOCATION_FIELDS)[0]
+        details = self._format_grid_cell(loc)
+        details.update({
+            'magento_id': loc['occupancy_magento_id'] or None,
+            'since': fields.Datetime.to_string(loc['occupancy_since']) if loc['occupancy_since'] else None,
+            'rate_7d': loc['occupancy_rate_7d'],
+            'times_used_7d': loc['occupancy_times_used_7d'],
+            'last_freed': fields.Datetime.to_string(loc['occupancy_last_freed']) if loc['occupancy_last_freed'] else None,
+        })
+        return details
+
+    # ============================================
+    # MAINTENANCE
+    # ============================================
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        layouts = super(LocationOccupancyLayout, self).create(vals_list)
+        layouts._relayout_locations()
+        return layouts
+
+    def write(self, vals):
+        roots = self.mapped('root_location_id')
+        res = super(LocationOccupancyLayout, self).write(vals)
+        if {'root_location_id', 'row_order', 'level_order', 'separator', 'active'}.intersection(vals):
+            self._relayout_locations(roots)
+        return res
+
+    def unlink(self):
+        roots = self.mapped('root_location_id')
+        res = super(LocationOccupancyLayout, self).unlink()
+        self._relayout_locations(roots)
+        return res
+
+    def _relayout_locations(self, extra_roots=None):
+        """Re-place every location under these layouts' roots"""
+        roots = self.exists().mapped('root_location_id')
+        if extra_roots:
+            roots |= extra_roots.exists()
+        locations = self.env['stock.location'].sudo().with_context(active_test=False).search([
+            '|',
+            ('location_id', 'in', roots.ids),
+            ('occupancy_layout_id', 'in', self.ids),
+        ])
+        if locations:
+            locations._update_occupancy_layout()
+            locations._refresh_occupancy()
+            locations._occupancy_layout_changed()
+
+    @api.model
+    def _relayout_all(self):
+        """Re-place the locations of every layout (run on module update)"""
+        self.search([])._relayout_locations()
+        return True
+
+    @api.model
+    def _ensure_default_layout(self):
+        """Create the PR-1 layout on install if PR-1 exists"""
+        root = self.env['stock.location'].browse(PR1_LOCATION_ID).exists()
+        if root and not self.with_context(active_test=False).search_count([]):
+            _logger.info("Creating default PR-1 occupancy layout")
+            self.create({'name': 'PR-1', 'root_location_id': root.id})
+        return True
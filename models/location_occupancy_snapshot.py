@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+import json
+import logging
+
+from ..tools import metrics
+
+_logger = logging.getLogger(__name__)
+
+# First key of the advisory lock taken while rebuilding a snapshot;
+# the second key is the layout id
+SNAPSHOT_LOCK_KEY = 0x4F434350
+
+
+class LocationOccupancySnapshot(models.Model):
+    """
+    Built grid data of a layout, shared by all worker processes.
+
+    One row per layout, with the occupancy version it was built at and
+    the number of change log rows then visible at or after it: the row is
+    current while that number does not move. A worker that finds the row
+    outdated rebuilds it under a transaction advisory lock; workers that
+    cannot take the lock serve the previous snapshot instead of rebuilding
+    the same data in parallel. Only read and written in SQL.
+    """
+    _name = 'location.occupancy.snapshot'
+    _description = 'Location Occupancy Grid Snapshot'
+    _log_access = False
+
+    layout_id = fields.Many2one(
+        'location.occupancy.layout',
+        string='Layout',
+        required=True,
+        readonly=True,
+        ondelete='cascade')
+
+    # Transaction ids do not fit an integer column
+    version = fields.Float(string='Version', digits=(20, 0), required=True, readonly=True)
+    seen = fields.Integer(string='Changes Seen', required=True, readonly=True, default=0)
+    built_at = fields.Datetime(string='Built At', required=True, readonly=True)
+    payload = fields.Text(string='Grid Data (JSON)', readonly=True)
+
+    _sql_constraints = [
+        ('layout_uniq', 'unique(layout_id)', 'Only one snapshot per layout.'),
+    ]
+
+    @api.model
+    def _get_grid_data(self, layout, max_age):
+        """
+        Current grid data of layout.
+
+        Returns (version, seen, response). The snapshot is older than the
+        data when another worker is rebuilding it; its version is then
+        older too, so the client catches up on its next refresh.
+        """
+        cr = self.env.cr
+        Location = self.env['stock.location']
+        cr.execute("""
+            SELECT version, seen, payload,
+                   built_at > (now() AT TIME ZONE 'UTC') - make_interval(secs => %s)
+              FROM location_occupancy_snapshot
+             WHERE layout_id = %s
+        """, [max_age, layout.id])
+        row = cr.fetchone()
+        if row:
+            row = (int(row[0]),) + row[1:]
+        if row and row[3] and Location._count_occupancy_changes(row[0]) == row[1]:
+            metrics.inc('occupancy_grid_snapshot_total', result='shared')
+            return row[0], row[1], json.loads(row[2])
+
+        # Single flight: only the lock holder rebuilds, the others serve
+        # what is there (unless there is nothing yet)
+        cr.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", [SNAPSHOT_LOCK_KEY, layout.id])
+        if not cr.fetchone()[0] and row:
+            metrics.inc('occupancy_grid_snapshot_total', result='stale')
+            return row[0], row[1], json.loads(row[2])
+
+        # Version, count and grid all come from this transaction's snapshot
+        version = Location._get_occupancy_version()
+        seen = Location._count_occupancy_changes(version)
+        response = layout._build_grid_data()
+        response['version'] = version
+        cr.execute("""
+            INSERT INTO location_occupancy_snapshot (layout_id, version, seen, built_at, payload)
+            VALUES (%s, %s, %s, now() AT TIME ZONE 'UTC', %s)
+            ON CONFLICT (layout_id) DO UPDATE
+               SET version = EXCLUDED.version,
+                   seen = EXCLUDED.seen,
+                   built_at = EXCLUDED.built_at,
+                   payload = EXCLUDED.payload
+             WHERE location_occupancy_snapshot.version <= EXCLUDED.version
+        """, [layout.id, version, seen, json.dumps(response, default=str)])
+        _logger.debug(f"Rebuilt occupancy snapshot of {layout.name} at version {version}")
+        return version, seen, response
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+# sale.order fields that affect the occupancy of its source location
+OCCUPANCY_ORDER_FIELDS = {'source_location_id', 'state', 'transport_unit_id', 'partner_id'}
+
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        orders = super(SaleOrder, self).create(vals_list)
+        orders.mapped('source_location_id')._refresh_occupancy()
+        return orders
+
+    def write(self, vals):
+        # skip_occupancy_refresh: the caller refreshes all locations at once
+        if (self.env.context.get('skip_occupancy_refresh')
+                or not OCCUPANCY_ORDER_FIELDS.intersection(vals)):
+            return super(SaleOrder, self).write(vals)
+
+        # Refresh both the locations being left and the ones being assigned
+        locations = self.mapped('source_location_id')
+        res = super(SaleOrder, self).write(vals)
+        (locations | self.mapped('source_location_id'))._refresh_occupancy()
+        return res
+
+    def unlink(self):
+        locations = self.mapped('source_location_id')
+        res = super(SaleOrder, self).unlink()
+        locations._refresh_occupancy()
+        return res
@@ -1,150 +1,218 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api
-from datetime import datetime
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+from collections import defaultdict
+from datetime import datetime, timedelta
 import logging
 
+from psycopg2 import OperationalError, errorcodes
+
+from odoo.tools import sql, html_escape
+
+from ..tools import metrics
+
 _logger = logging.getLogger(__name__)
 
+# sale.order states in which an order holds its source location
+OCCUPANCY_ORDER_STATES = ('manufactured', 'ready_package', 'ready_picking')
+
+# sale.order states in which an order gives up its source location. An
+# order in any other state (e.g. draft) keeps the location from being
+# allocated or reassigned, even while it does not count as occupancy.
+OCCUPANCY_RELEASED_STATES = ('cancel', 'done')
+
+# stock.location fields that change how the grid is laid out
+OCCUPANCY_LAYOUT_FIELDS = {'name', 'barcode', 'active', 'location_id'}
+
+# Tracking flag and grid placement of a location outside any layout
+OCCUPANCY_NO_LAYOUT_VALUES = {
+    'is_pr1_location': False,
+    'occupancy_layout_id': False,
+    'occupancy_row': False,
+    'occupancy_level': False,
+    'occupancy_column': 0,
+    'occupancy_column_label': False,
+    'occupancy_row_seq': 0,
+    'occupancy_level_seq': 0,
+}
+
+# Bus channel for live grid updates
+OCCUPANCY_BUS_CHANNEL = 'personalizirai_location_occupancy'
+
+# Occupancy change log rows are kept this long; clients whose watermark
+# is older than the pruned rows reload the whole grid
+OCCUPANCY_CHANGE_RETENTION = timedelta(days=1)
+
+# Free locations locked per round by _allocate_free_location
+ALLOCATION_CANDIDATES = 10
+
+# Searchable text of a location; must match the trigram index expression
+OCCUPANCY_SEARCH_EXPR = (
+    "(COALESCE(name, '') || ' ' || COALESCE(occupancy_order_name, '') || ' ' || "
+    "COALESCE(occupancy_magento_id, '') || ' ' || COALESCE(occupancy_customer, '') || ' ' || "
+    "COALESCE(occupancy_transport_unit, ''))"
+)
+
+# stock.location fields the barcode scan index depends on
+OCCUPANCY_BARCODE_FIELDS = {'barcode', 'active', 'occupancy_layout_id'}
+
+# Values of a location without an assigned order
+OCCUPANCY_FREE_VALUES = {
+    'occupancy_status': 'free',
+    'occupancy_order_id': False,
+    'occupancy_order_name': False,
+    'occupancy_magento_id': False,
+    'occupancy_customer': False,
+    'occupancy_since': False,
+    'occupancy_transport_unit': False,
+}
+
 
 class StockLocation(models.Model):
     _inherit = 'stock.location'
-    
+
     # ============================================
-    # COMPUTED FIELDS - Real-time Status
+    # STORED FIELDS - Maintained by sale.order triggers
     # ============================================
-    
+
     occupancy_status = fields.Selection([
         ('free', 'Free'),
         ('reserved', 'Reserved'),
         ('occupied', 'Occupied'),
-    ], string='Occupancy Status', 
-       compute='_compute_occupancy_status', 
-       store=False,
-       help="Real-time location occupancy status")
-    
+    ], string='Occupancy Status',
+       default='free',
+       required=True,
+       readonly=True,
+       copy=False,
+       index=True,
+       help="Location occupancy status, updated whenever an assigned order changes")
+
     occupancy_order_id = fields.Many2one(
-        'sale.order', 
+        'sale.order',
         string='Assigned Order',
-        compute='_compute_occupancy_status', 
-        store=False)
-    
+        readonly=True,
+        copy=False,
+        index=True)
+
     occupancy_order_name = fields.Char(
-        string='Order Number', 
-        compute='_compute_occupancy_status', 
-        store=False)
-    
+        string='Order Number',
+        readonly=True,
+        copy=False)
+
     occupancy_magento_id = fields.Char(
-        string='Magento Order', 
-        compute='_compute_occupancy_status', 
-        store=False)
-    
+        string='Magento Order',
+        readonly=True,
+        copy=False)
+
     occupancy_customer = fields.Char(
-        string='Customer', 
-        compute='_compute_occupancy_status', 
-        store=False)
-    
+        string='Customer',
+        readonly=True,
+        copy=False)
+
     occupancy_since = fields.Datetime(
-        string='Occupied/Reserved Since', 
-        compute='_compute_occupancy_status', 
-        store=False)
-    
+        string='Occupied/Reserved Since',
+        readonly=True,
+        copy=False,
+        help="Moment the location became reserved/occupied by its current order")
+
     occupancy_duration_hours = fields.Float(
-        string='Duration (Hours)', 
-        compute='_compute_occupancy_status', 
+        string='Duration (Hours)',
+        compute='_compute_occupancy_duration',
         store=False,
         help="How long location has been in current status")
-    
+
     occupancy_transport_unit = fields.Char(
         string='Transport Unit',
-        compute='_compute_occupancy_status',
-        store=False,
+        readonly=True,
+        copy=False,
         help="Transport box/unit code")
-    
+
     # ============================================
     # STATISTICS - 7 Day History (Phase 4)
     # ============================================
-    
+
     occupancy_rate_7d = fields.Float(
-        string='7-Day Utilization %', 
-        compute='_compute_occupancy_stats', 
+        string='7-Day Utilization %',
+        compute='_compute_occupancy_stats',
         store=False,
         help="Percentage of time occupied in last 7 days")
-    
+
     occupancy_avg_duration = fields.Float(
-        string='Avg Duration (Hours)', 
-        compute='_compute_occupancy_stats', 
+        string='Avg Duration (Hours)',
+        compute='_compute_occupancy_stats',
         store=False,
         help="Average occupation duration")
-    
+
     occupancy_times_used_7d = fields.Integer(
-        string='Times Used (7d)', 
-        compute='_compute_occupancy_stats', 
+        string='Times Used (7d)',
+        compute='_compute_occupancy_stats',
         store=False,
         help="Number of times location was used in last 7 days")
-    
+
     occupancy_last_order = fields.Char(
-        string='Last Order', 
-        compute='_compute_occupancy_stats', 
+        string='Last Order',
+        compute='_compute_occupancy_stats',
         store=False)
-    
+
     occupancy_last_freed = fields.Datetime(
-        string='Last Freed', 
-        compute='_compute_occupancy_stats', 
+        string='Last Freed',
+        compute='_compute_occupancy_stats',
         store=False)
-    
+
+    # ============================================
+    # LAYOUT INDEX - Maintained by location.occupancy.layout
+    # ============================================
+
+    occupancy_layout_id = fields.Many2one(
+        'location.occupancy.layout',
+        string='Occupancy Layout',
+        readonly=True,
+        copy=False,
+        index=True,
+        ondelete='set null')
+
+    occupancy_row = fields.Char(string='Row', readonly=True, copy=False)
+    occupancy_level = fields.Char(string='Level', readonly=True, copy=False)
+    occupancy_column = fields.Integer(string='Column', readonly=True, copy=False)
+    occupancy_column_label = fields.Char(string='Column Label', readonly=True, copy=False)
+    occupancy_row_seq = fields.Integer(string='Row Sequence', readonly=True, copy=False)
+    occupancy_level_seq = fields.Integer(string='Level Sequence', readonly=True, copy=False)
+
     # ============================================
     # HELPER FIELDS
     # ============================================
-    
+
     is_pr1_location = fields.Boolean(
-        string='Is PR-1 Location', 
-        compute='_compute_is_pr1_location', 
-        store=False,
-        search='_search_is_pr1_location',
-        help="True if location is child of PR-1 warehouse")
-    
+        string='Is Tracked Location',
+        readonly=True,
+        copy=False,
+        index=True,
+        help="True if location is a direct child of an occupancy layout root (e.g. PR-1), "
+             "whether or not its name places it on the grid")
+
     pr1_zone = fields.Selection([
         ('malak_sklad', 'Малък Склад'),
         ('calandar', 'Calandar'),
         ('teniski', 'Teniski'),
         ('other', 'Other'),
-    ], string='PR-1 Zone', 
-       compute='_compute_pr1_zone', 
-       store=False)
-    
+    ], string='PR-1 Zone',
+       compute='_compute_pr1_zone',
+       store=True)
+
     # ============================================
     # COMPUTE METHODS
     # ============================================
-    
-    @api.depends('name', 'location_id')
-    def _compute_is_pr1_location(self):
-        """Check if location is child of PR-1 (location_id = 19)"""
-        for location in self:
-            # Check if parent is PR-1 or if this is PR-1
-            location.is_pr1_location = (
-                location.location_id.id == 19 or 
-                location.id == 19
-            )
-    
-    def _search_is_pr1_location(self, operator, value):
-        """Enable searching by is_pr1_location"""
-        if operator == '=' and value:
-            return [('location_id', '=', 19)]
-        elif operator == '=' and not value:
-            return [('location_id', '!=', 19)]
-        else:
-            return []
-    
-    @api.depends('name', 'complete_name')
+
+    @api.depends('name', 'is_pr1_location')
     def _compute_pr1_zone(self):
         """Determine which PR-1 zone this location belongs to"""
         for location in self:
             if not location.is_pr1_location:
                 location.pr1_zone = 'other'
                 continue
-            
+
             name = location.name or ''
-            
+
             # Малък Склад: M-001 to M-100
             if name.startswith('M-'):
                 location.pr1_zone = 'malak_sklad'
@@ -156,128 +224,811 @@ class StockLocation(models.Model):
                 location.pr1_zone = 'teniski'
             else:
                 location.pr1_zone = 'other'
-    
-    @api.depends('name')  # Dummy depend - will trigger on context reload
-    def _compute_occupancy_status(self):
+
+    @api.depends('occupancy_since')
+    def _compute_occupancy_duration(self):
+        """Hours since the location entered its current status"""
+        now = datetime.now()
+        for location in self:
+            if location.occupancy_since:
+                duration = now - location.occupancy_since
+                location.occupancy_duration_hours = duration.total_seconds() / 3600.0
+            else:
+                location.occupancy_duration_hours = 0.0
+
+    # ============================================
+    # OCCUPANCY MAINTENANCE
+    # ============================================
+
+    def init(self):
+        # Grid reads are ORDER BY layout position within a layout
+        sql.create_index(
+            self.env.cr, 'stock_location_occupancy_layout_position_idx', self._table,
+            ['occupancy_layout_id', 'occupancy_row_seq', 'occupancy_row',
+             'occupancy_level_seq', 'occupancy_level', 'occupancy_column'])
+
+        # Free-slot index: only free grid cells, in allocation order
+        if not sql.index_exists(self.env.cr, 'stock_location_occupancy_free_slot_idx'):
+            self.env.cr.execute("""
+                CREATE INDEX stock_location_occupancy_free_slot_idx
+                    ON stock_location (occupancy_layout_id, occupancy_row_seq,
+                                       occupancy_level_seq, occupancy_column)
+                 WHERE occupancy_status = 'free' AND active AND usage = 'internal'
+            """)
+
+        # Long-occupancy alerts are a range scan over busy locations only
+        if not sql.index_exists(self.env.cr, 'stock_location_occupancy_since_idx'):
+            self.env.cr.execute("""
+                CREATE INDEX stock_location_occupancy_since_idx
+                    ON stock_location (occupancy_since)
+                 WHERE occupancy_since IS NOT NULL
+            """)
+
+        # Trigram index for quick search (skipped if pg_trgm is unavailable)
+        if not sql.index_exists(self.env.cr, 'stock_location_occupancy_search_idx'):
+            try:
+                with self.env.cr.savepoint():
+                    self.env.cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                    self.env.cr.execute(f"""
+                        CREATE INDEX stock_location_occupancy_search_idx
+                            ON stock_location USING gin ({OCCUPANCY_SEARCH_EXPR} gin_trgm_ops)
+                         WHERE occupancy_layout_id IS NOT NULL
+                    """)
+            except Exception as e:
+                _logger.warning(f"⚠️ Occupancy search index not created (pg_trgm missing?): {e}")
+
+        # Insert-only log of occupancy/layout changes, one row per writing
+        # transaction step, tagged with the writer's transaction id
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS location_occupancy_change (
+                id bigserial PRIMARY KEY,
+                xid bigint NOT NULL DEFAULT txid_current(),
+                location_ids integer[] NOT NULL,
+                reload boolean NOT NULL DEFAULT FALSE,
+                changed_at timestamp NOT NULL DEFAULT (now() AT TIME ZONE 'UTC')
+            )
+        """)
+        sql.create_index(
+            self.env.cr, 'location_occupancy_change_xid_idx', 'location_occupancy_change', ['xid'])
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        locations = super(StockLocation, self).create(vals_list)
+        if any(vals.get('barcode') for vals in vals_list):
+            self.clear_caches()  # Barcode scan index
+        locations._update_occupancy_layout()
+        if any(locations.mapped('is_pr1_location')):
+            locations._occupancy_layout_changed()
+        return locations
+
+    def write(self, vals):
+        layout_change = bool(OCCUPANCY_LAYOUT_FIELDS.intersection(vals))
+        was_tracked = layout_change and any(self.mapped('is_pr1_location'))
+        res = super(StockLocation, self).write(vals)
+        if OCCUPANCY_BARCODE_FIELDS.intersection(vals):
+            self.clear_caches()  # Barcode scan index
+        if 'name' in vals or 'location_id' in vals:
+            self._update_occupancy_layout()
+        if 'location_id' in vals:
+            # Moving a location in or out of a layout changes what it tracks
+            self._refresh_occupancy()
+        if layout_change and (was_tracked or any(self.mapped('is_pr1_location'))):
+            self._occupancy_layout_changed()
+        return res
+
+    def unlink(self):
+        was_tracked = any(self.mapped('is_pr1_location'))
+        was_scannable = any(location.barcode and location.occupancy_layout_id for location in self)
+        res = super(StockLocation, self).unlink()
+        if was_scannable:
+            self.clear_caches()  # Barcode scan index
+        if was_tracked:
+            version = self._log_occupancy_change(reload=True)
+            self.browse()._notify_occupancy_change(version, reload=True)
+        return res
+
+    def _update_occupancy_layout(self):
+        """
+        Store whether the location is tracked (child of a layout root) and
+        its grid placement (row/level/column) parsed from the name.
+
+        Children whose name does not parse (e.g. M-001, C-01) stay tracked
+        but are not placed on the grid.
         """
-        Compute real-time occupancy status with BATCH optimization.
-        
+        locations = self.sudo().exists()
+        layouts = self.env['location.occupancy.layout'].sudo().search([
+            ('root_location_id', 'in', locations.mapped('location_id').ids)
+        ])
+        layout_by_root = {layout.root_location_id.id: layout for layout in layouts}
+        for location in locations:
+            layout = layout_by_root.get(location.location_id.id)
+            values = dict(OCCUPANCY_NO_LAYOUT_VALUES, is_pr1_location=bool(layout))
+            placement = layout._parse_location_name(location.name) if layout else None
+            if placement:
+                values.update(placement, occupancy_layout_id=layout.id)
+            changes = location._occupancy_changes(values)
+            if changes:
+                location.write(changes)
+
+    def _occupancy_layout_changed(self):
+        """Log a layout change; grids must reload"""
+        version = self._log_occupancy_change(reload=True)
+        self._notify_occupancy_change(version, reload=True)
+
+    @api.model
+    def _get_occupancy_version(self):
+        """
+        Occupancy version (change watermark) of the data this transaction sees.
+
+        It is the oldest transaction id still running when the snapshot
+        was taken: every change logged by an older transaction is
+        finished, hence visible here if committed. Changes logged at or
+        above it may still be in progress; the next delta from this
+        version returns them once committed (possibly more than once).
+        """
+        self.env.cr.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _get_occupancy_changes(self, since_version):
+        """
+        Changes visible to this transaction that may be missing from data
+        at since_version.
+
+        Returns (location ids, reload): reload is true when a layout
+        changed or log rows a client may need were already pruned.
+        """
+        pruned_until = self.env['ir.config_parameter'].sudo().get_param(
+            'personalizirai_location_occupancy.changes_pruned_until')
+        if pruned_until and since_version <= int(pruned_until):
+            return set(), True
+        self.env.cr.execute("""
+            SELECT location_ids, reload FROM location_occupancy_change WHERE xid >= %s
+        """, [since_version])
+        location_ids = set()
+        reload = False
+        for ids, row_reload in self.env.cr.fetchall():
+            location_ids.update(ids)
+            reload = reload or row_reload
+        return location_ids, reload
+
+    @api.model
+    def _count_occupancy_changes(self, since_version):
+        """Number of visible change log rows at or after since_version"""
+        self.env.cr.execute(
+            "SELECT count(*) FROM location_occupancy_change WHERE xid >= %s", [since_version])
+        return self.env.cr.fetchone()[0]
+
+    def _notify_occupancy_change(self, version, reload=False):
+        """
+        Publish an occupancy change on the bus.
+
+        Sent on commit only (bus.bus defers the NOTIFY), so open grids
+        fetch the delta right after the data becomes visible.
+        """
+        self.env['bus.bus'].sendone(OCCUPANCY_BUS_CHANNEL, {
+            'type': 'occupancy_changed',
+            'version': version,
+            'location_ids': self.ids,
+            'reload': reload,
+        })
+
+    def _log_occupancy_change(self, reload=False):
+        """
+        Record that these locations changed and return the version of
+        the change (the id of the current transaction).
+
+        Only inserts a row: concurrent writers never wait for each other
+        nor conflict on a shared counter. The row becomes visible with
+        the data that caused it, when the transaction commits.
+        """
+        self.env.cr.execute("""
+            INSERT INTO location_occupancy_change (location_ids, reload)
+            VALUES (%s, %s)
+         RETURNING xid
+        """, [self.ids, reload])
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _cron_prune_occupancy_changes(self):
+        """Drop change log rows older than OCCUPANCY_CHANGE_RETENTION"""
+        self.env.cr.execute("""
+            DELETE FROM location_occupancy_change
+             WHERE changed_at < %s
+         RETURNING xid
+        """, [fields.Datetime.now() - OCCUPANCY_CHANGE_RETENTION])
+        pruned = [row[0] for row in self.env.cr.fetchall()]
+        if pruned:
+            # Clients at or before these versions can no longer get a delta
+            ICP = self.env['ir.config_parameter'].sudo()
+            key = 'personalizirai_location_occupancy.changes_pruned_until'
+            ICP.set_param(key, str(max(max(pruned), int(ICP.get_param(key) or 0))))
+        _logger.info(f"Pruned {len(pruned)} occupancy change log rows")
+        return True
+
+    @metrics.timed('refresh_occupancy')
+    def _refresh_occupancy(self):
+        """
+        Recompute the stored occupancy fields of these locations.
+
         LOGIC:
         - OCCUPIED: Order has transport_unit_id (physical box assigned)
         - RESERVED: Order assigned but no transport_unit_id yet
         - FREE: No order assigned
-        
-        OPTIMIZED: Uses batch query instead of individual searches.
-        """
-        # Filter only PR-1 locations
-        pr1_locations = self.filtered(lambda l: l.location_id.id == 19 or l.id == 19)
-        other_locations = self - pr1_locations
-        
-        # Set defaults for non-PR-1 locations
-        for location in other_locations:
-            location._set_default_occupancy_values()
-        
-        if not pr1_locations:
+
+        Called by sale.order with only the locations an order change
+        touched, so the cost is proportional to the change and not to
+        the warehouse. Only locations whose values differ are written.
+        """
+        locations = self.sudo().exists()
+        if not locations:
             return
-        
-        try:
-            # BATCH QUERY: Get all orders assigned to these locations
-            # Including transport_unit_id for OCCUPIED detection
-            location_ids = pr1_locations.ids
-            orders = self.env['sale.order'].search([
-                ('source_location_id', 'in', location_ids),
-                ('state', 'in', ['manufactured', 'ready_package', 'ready_picking'])
-            ])
-            
-            # Map: location_id -> order
-            location_order_map = {o.source_location_id.id: o for o in orders}
-            
-            # Process each location with the cached data
-            for location in pr1_locations:
-                order = location_order_map.get(location.id)
-                
-                if order:
-                    # Check if order has transport unit (box)
-                    if order.transport_unit_id:
-                        # OCCUPIED: Has physical box assigned
-                        location.occupancy_status = 'occupied'
-                        location._populate_order_info(order, has_transport_unit=True)
-                        _logger.debug(f"🔴 Location {location.name} OCCUPIED - Order {order.name} has transport unit {order.transport_unit_id.name}")
-                    else:
-                        # RESERVED: Order assigned but no box yet
-                        location.occupancy_status = 'reserved'
-                        location._populate_order_info(order, has_transport_unit=False)
-                        _logger.debug(f"🟡 Location {location.name} RESERVED - Order {order.name} waiting for transport unit")
-                else:
-                    # FREE: Not assigned
-                    location.occupancy_status = 'free'
-                    location._set_default_occupancy_values()
-                    _logger.debug(f"🟢 Location {location.name} FREE")
-                    
-        except Exception as e:
-            _logger.error(f"❌ Error in batch occupancy computation: {str(e)}", exc_info=True)
-            # Set defaults for all on error
-            for location in pr1_locations:
-                location._set_default_occupancy_values()
-    
-    def _set_default_occupancy_values(self):
-        """Helper to set default/empty values"""
-        self.occupancy_status = 'free'
-        self.occupancy_order_id = False
-        self.occupancy_order_name = False
-        self.occupancy_magento_id = False
-        self.occupancy_customer = False
-        self.occupancy_since = False
-        self.occupancy_duration_hours = 0.0
-        self.occupancy_transport_unit = False
-    
-    def _populate_order_info(self, order, has_transport_unit=False):
-        """Helper to populate order-related fields"""
-        self.occupancy_order_id = order.id
-        self.occupancy_order_name = order.name
-        
-        # Try to get Magento ID if field exists
-        try:
-            self.occupancy_magento_id = order.magento_id if hasattr(order, 'magento_id') else False
-        except:
-            self.occupancy_magento_id = False
-        
-        self.occupancy_customer = order.partner_id.name if order.partner_id else 'Unknown'
-        
-        # Get transport unit info if exists
-        if has_transport_unit and order.transport_unit_id:
-            try:
-                transport_unit = order.transport_unit_id
-                self.occupancy_transport_unit = f"{transport_unit.name} ({transport_unit.code})"
-            except:
-                self.occupancy_transport_unit = "BOX-???"
-        else:
-            self.occupancy_transport_unit = False
-        
-        # Use order write_date as approximation (faster than tracking search)
-        self.occupancy_since = order.write_date
-        
-        # Calculate duration
-        if self.occupancy_since:
-            try:
-                duration = datetime.now() - self.occupancy_since
-                self.occupancy_duration_hours = duration.total_seconds() / 3600.0
-            except:
-                self.occupancy_duration_hours = 0.0
-        else:
-            self.occupancy_duration_hours = 0.0
-    
-    @api.depends('name')  # Dummy depend - Phase 4 will implement
+        metrics.inc('occupancy_refresh_locations_total', len(locations))
+
+        pr1_locations = locations.filtered('is_pr1_location')
+        values_map, conflicts = pr1_locations._fetch_occupancy_values()
+        if conflicts:
+            pr1_locations._report_occupancy_conflicts(conflicts)
+
+        now = fields.Datetime.now()
+        pending = []
+        for location in locations:
+            values = values_map.get(location.id) or dict(OCCUPANCY_FREE_VALUES)
+            # Busy since the moment it left 'free' or changed order
+            if values['occupancy_status'] != 'free' and (
+                    location.occupancy_status == 'free'
+                    or values['occupancy_order_id'] != location.occupancy_order_id.id
+                    or not location.occupancy_since):
+                values['occupancy_since'] = now
+            changes = location._occupancy_changes(values)
+            if changes:
+                pending.append((location, changes))
+
+        if not pending:
+            return
+
+        # Log transitions (status or order change) before overwriting them
+        history_vals = [{
+            'location_id': location.id,
+            'order_id': changes.get('occupancy_order_id', location.occupancy_order_id.id),
+            'from_status': location.occupancy_status,
+            'to_status': changes.get('occupancy_status', location.occupancy_status),
+            'timestamp': now,
+        } for location, changes in pending
+            if 'occupancy_status' in changes or 'occupancy_order_id' in changes]
+        if history_vals:
+            self.env['location.occupancy.history'].sudo()._log_transitions(history_vals)
+
+        # Locations with identical changes (e.g. all freed) share one write
+        locations_by_changes = defaultdict(list)
+        for location, changes in pending:
+            locations_by_changes[tuple(sorted(changes.items()))].append(location.id)
+        for changes, location_ids in locations_by_changes.items():
+            locations.browse(location_ids).write(dict(changes))
+
+        # One change log row for the whole refresh
+        changed = self.browse([location.id for location, changes in pending])
+        changed._notify_occupancy_change(changed._log_occupancy_change())
+
+    def _fetch_occupancy_values(self):
+        """
+        Occupancy values of these (PR-1) locations from their assigned orders.
+
+        Returns ({location_id: values}, {location_id: [order names]}), the
+        second dict listing locations claimed by more than one order. The
+        latest order (highest id) wins for display. The SQL engine is used
+        when the 'personalizirai_location_occupancy.sql_engine' parameter is
+        set; both run a constant number of queries.
+        """
+        if not self:
+            return {}, {}
+        use_sql = self.env['ir.config_parameter'].sudo().get_param(
+            'personalizirai_location_occupancy.sql_engine')
+        if use_sql:
+            return self._fetch_occupancy_values_sql()
+        return self._fetch_occupancy_values_orm()
+
+    def _fetch_occupancy_values_orm(self):
+        """ORM engine: one search plus batched prefetch of related records"""
+        orders = self.env['sale.order'].sudo().search([
+            ('source_location_id', 'in', self.ids),
+            ('state', 'in', list(OCCUPANCY_ORDER_STATES))
+        ], order='id')
+
+        # Map: location_id -> orders (oldest first)
+        orders_by_location = defaultdict(list)
+        for order in orders:
+            orders_by_location[order.source_location_id.id].append(order)
+
+        values_map = {
+            location_id: self._occupancy_values(location_orders[-1])
+            for location_id, location_orders in orders_by_location.items()
+        }
+        conflicts = {
+            location_id: [o.name for o in location_orders]
+            for location_id, location_orders in orders_by_location.items()
+            if len(location_orders) > 1
+        }
+        return values_map, conflicts
+
+    def _fetch_occupancy_values_sql(self):
+        """SQL engine: every field the grid needs in one JOIN query"""
+        SaleOrder = self.env['sale.order']
+        transport_model = self.env[SaleOrder._fields['transport_unit_id'].comodel_name]
+        magento_column = 'so.magento_id' if (
+            'magento_id' in SaleOrder._fields and SaleOrder._fields['magento_id'].store
+        ) else 'NULL'
+        code_column = 'tu.code' if 'code' in transport_model._fields else 'NULL'
+
+        # Called right after sale.order writes, still pending in the cache
+        SaleOrder.flush(['source_location_id', 'state', 'transport_unit_id', 'partner_id'])
+        self.env.cr.execute(f"""
+            SELECT so.source_location_id, so.id, so.name, {magento_column},
+                   rp.name, tu.id, tu.name, {code_column}
+              FROM sale_order so
+         LEFT JOIN res_partner rp ON rp.id = so.partner_id
+         LEFT JOIN {transport_model._table} tu ON tu.id = so.transport_unit_id
+             WHERE so.source_location_id = ANY(%s)
+               AND so.state IN %s
+          ORDER BY so.source_location_id, so.id
+        """, (self.ids, OCCUPANCY_ORDER_STATES))
+
+        values_map = {}
+        order_names = defaultdict(list)
+        for (location_id, order_id, order_name, magento_id,
+                customer, unit_id, unit_name, unit_code) in self.env.cr.fetchall():
+            order_names[location_id].append(order_name)
+            # Rows are ordered by id, so the latest order overwrites
+            values_map[location_id] = {
+                'occupancy_status': 'occupied' if unit_id else 'reserved',
+                'occupancy_order_id': order_id,
+                'occupancy_order_name': order_name,
+                'occupancy_magento_id': magento_id or False,
+                'occupancy_customer': customer or 'Unknown',
+                'occupancy_transport_unit': f"{unit_name} ({unit_code})" if unit_id else False,
+            }
+        conflicts = {
+            location_id: names for location_id, names in order_names.items() if len(names) > 1
+        }
+        return values_map, conflicts
+
+    def _report_occupancy_conflicts(self, conflicts):
+        """Log locations claimed by several active orders at once"""
+        names = dict((location.id, location.name) for location in self)
+        for location_id, order_names in conflicts.items():
+            _logger.warning(
+                f"⚠️ Location {names.get(location_id, location_id)} has "
+                f"{len(order_names)} active orders: {', '.join(order_names)}")
+
+    @api.model
+    def _get_occupancy_conflicts(self):
+        """All PR-1 locations currently claimed by more than one order"""
+        locations = self.sudo().search([('is_pr1_location', '=', True)])
+        return locations._fetch_occupancy_values()[1]
+
+    def _occupancy_values(self, order):
+        """Build the stored occupancy values for an assigned order (or none)"""
+        if not order:
+            return dict(OCCUPANCY_FREE_VALUES)
+
+        transport_unit = order.transport_unit_id
+        return {
+            'occupancy_status': 'occupied' if transport_unit else 'reserved',
+            'occupancy_order_id': order.id,
+            'occupancy_order_name': order.name,
+            'occupancy_magento_id': order.magento_id if 'magento_id' in order._fields else False,
+            'occupancy_customer': order.partner_id.name or 'Unknown',
+            'occupancy_transport_unit': (
+                f"{transport_unit.name} ({transport_unit.code})" if transport_unit else False
+            ),
+        }
+
+    def _occupancy_changes(self, values):
+        """Return the subset of values that differ from the stored ones"""
+        self.ensure_one()
+        changes = {}
+        for fname, value in values.items():
+            current = self[fname]
+            if self._fields[fname].type == 'many2one':
+                current = current.id
+            if (current or False) != (value or False):
+                changes[fname] = value
+        return changes
+
+    @api.model
+    def _backfill_occupancy(self):
+        """
+        One-shot recompute of every tracked location.
+
+        Run after install/upgrade or to repair drift:
+            env['stock.location']._backfill_occupancy()
+        """
+        roots = self.env['location.occupancy.layout'].sudo().search([]).mapped('root_location_id')
+        locations = self.sudo().search([
+            '|', '|',
+            ('location_id', 'in', roots.ids),
+            ('is_pr1_location', '=', True),
+            ('occupancy_status', '!=', 'free'),
+        ])
+        _logger.info(f"Backfilling occupancy for {len(locations)} locations")
+        locations._update_occupancy_layout()
+        locations._refresh_occupancy()
+        locations._backfill_occupancy_since()
+        return True
+
+    def _backfill_occupancy_since(self):
+        """
+        Set occupancy_since of busy locations to the start of their stint.
+
+        The start is the first transition to the current order after the
+        location was last freed. Stints older than the history (e.g. on
+        install, where the only transition is the one just logged) fall
+        back to the order's last write: an order is written when it gets
+        its location or becomes active, so that moment is never later
+        than it, and the earlier of both is kept.
+        """
+        # Runs right after _refresh_occupancy, whose writes are still pending
+        self.flush(['occupancy_order_id', 'occupancy_status', 'occupancy_since'])
+        self.env.cr.execute("""
+            WITH first_busy AS (
+                    SELECT h.location_id, MIN(h.timestamp) AS since
+                      FROM location_occupancy_history h
+                      JOIN stock_location cur ON cur.id = h.location_id
+                                             AND cur.occupancy_order_id = h.order_id
+                     WHERE h.location_id = ANY(%(ids)s)
+                       AND h.to_status != 'free'
+                       AND NOT EXISTS (
+                            SELECT 1 FROM location_occupancy_history freed
+                             WHERE freed.location_id = h.location_id
+                               AND freed.to_status = 'free'
+                               AND freed.timestamp > h.timestamp
+                       )
+                  GROUP BY h.location_id
+            ), stint AS (
+                    -- LEAST ignores a missing history start
+                    SELECT l.id AS location_id, LEAST(first_busy.since, so.write_date) AS since
+                      FROM stock_location l
+                      JOIN sale_order so ON so.id = l.occupancy_order_id
+                 LEFT JOIN first_busy ON first_busy.location_id = l.id
+                     WHERE l.id = ANY(%(ids)s)
+                       AND l.occupancy_status != 'free'
+            )
+            UPDATE stock_location l
+               SET occupancy_since = stint.since
+              FROM stint
+             WHERE l.id = stint.location_id
+               AND stint.since IS NOT NULL
+               AND l.occupancy_since IS DISTINCT FROM stint.since
+        """, {'ids': self.ids})
+        self.invalidate_cache(['occupancy_since'], self.ids)
+
+    @api.model
+    def _cron_long_occupancy_alert(self):
+        """
+        Notify stock managers of locations busy for longer than the limit.
+
+        One range query on the occupancy_since index finds the locations
+        that crossed the limit since the previous run (stored watermark),
+        so each stint is reported once; all of them go out in one email.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        watermark_key = 'personalizirai_location_occupancy.long_occupancy_alerted_until'
+        days = int(ICP.get_param('personalizirai_location_occupancy.long_occupancy_days') or 7)
+        cutoff = fields.Datetime.now() - timedelta(days=days)
+        watermark = fields.Datetime.to_datetime(ICP.get_param(watermark_key))
+
+        domain = [('occupancy_since', '<', cutoff), ('occupancy_status', '!=', 'free')]
+        if watermark:
+            domain.append(('occupancy_since', '>=', watermark))
+        locations = self.sudo().search(domain, order='occupancy_since')
+        ICP.set_param(watermark_key, fields.Datetime.to_string(cutoff))
+        if not locations:
+            return True
+
+        managers = self.env.ref('stock.group_stock_manager').users.mapped('partner_id')
+        recipients = managers.filtered('email')
+        if not recipients:
+            _logger.warning(f"⚠️ {len(locations)} long-occupied locations, but no stock manager has an email")
+            return True
+
+        lines = ''.join(
+            f"<tr><td>{html_escape(location.name)}</td><td>{html_escape(location.occupancy_order_name or '')}</td>"
+            f"<td>{html_escape(location.occupancy_customer or '')}</td>"
+            f"<td>{round(location.occupancy_duration_hours / 24, 1)}</td></tr>"
+            for location in locations)
+        self.env['mail.mail'].sudo().create({
+            'subject': f"{len(locations)} locations occupied for more than {days} days",
+            'body_html': (
+                f"<p>These locations have been reserved/occupied for more than {days} days:</p>"
+                f"<table><tr><th>Location</th><th>Order</th><th>Customer</th><th>Days</th></tr>"
+                f"{lines}</table>"),
+            'recipient_ids': [(6, 0, recipients.ids)],
+        })
+        _logger.info(f"Sent long-occupancy alert for {len(locations)} locations")
+        return True
+
+    @api.model
+    def _search_occupancy(self, text, layout=None, limit=200):
+        """
+        Grid locations whose location name, order, Magento ID, customer or
+        transport box contain every word of text (case-insensitive).
+
+        Runs on the stored occupancy columns through the trigram index,
+        so substrings of any word are found without a sequential scan.
+        Returns [(location_id, occupancy_row)] in grid order.
+        """
+        words = [word for word in (text or '').split() if word]
+        if not words:
+            return []
+        clauses = ' AND '.join([f"{OCCUPANCY_SEARCH_EXPR} ILIKE %s"] * len(words))
+        params = [
+            '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            for word in words
+        ]
+        layout_clause = ''
+        if layout:
+            layout_clause = 'AND occupancy_layout_id = %s'
+            params.append(layout.id)
+        self.env.cr.execute(f"""
+            SELECT id, occupancy_row
+              FROM stock_location
+             WHERE occupancy_layout_id IS NOT NULL
+               AND active AND usage = 'internal'
+               AND {clauses}
+               {layout_clause}
+          ORDER BY occupancy_row_seq, occupancy_row, occupancy_level_seq,
+                   occupancy_level, occupancy_column, id
+             LIMIT %s
+        """, params + [limit])
+        return self.env.cr.fetchall()
+
+    # ============================================
+    # BARCODE SCAN
+    # ============================================
+
+    @api.model
+    @tools.ormcache()
+    def _get_occupancy_barcode_index(self):
+        """
+        {barcode: location id} of every grid location, cached per worker.
+
+        Cleared (registry-wide, all workers) whenever a location barcode,
+        active flag or layout changes. Do not modify the returned dict.
+        """
+        self.env.cr.execute("""
+            SELECT barcode, id FROM stock_location
+             WHERE barcode IS NOT NULL AND active AND occupancy_layout_id IS NOT NULL
+        """)
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _scan_occupancy(self, barcodes):
+        """
+        Occupancy of the locations with these barcodes.
+
+        Returns [(barcode, cell or None)] in the given order, cells in the
+        grid_data format. One read of the stored fields for the whole
+        batch; nothing else is recomputed.
+        """
+        index = self._get_occupancy_barcode_index()
+        location_ids = {index[barcode] for barcode in barcodes if barcode in index}
+        locations = self.browse(location_ids)
+        Layout = self.env['location.occupancy.layout']
+        cells = {cell['id']: cell for cell in Layout._read_grid_cells(locations)}
+        return [(barcode, cells.get(index.get(barcode))) for barcode in barcodes]
+
+    # ============================================
+    # ALLOCATION
+    # ============================================
+
+    @api.model
+    def _allocate_free_location(self, order, layout=None, near_location=None):
+        """
+        Pick the best free location for order and reserve it.
+
+        Preference: the row of near_location (default: another active order
+        of the same customer), then the lowest level, then the nearest
+        column. Candidates come from the partial free-slot index, not from
+        every location, and are locked one at a time with FOR UPDATE SKIP
+        LOCKED, so concurrent allocations skip each other's picks instead
+        of waiting or double-booking. A candidate taken by an allocation
+        that committed after this transaction started fails to lock with
+        a serialization error (the winner always updates the row); it is
+        skipped inside a savepoint instead of failing the whole request.
+        Assigning the order then marks the location reserved in the same
+        transaction.
+        """
+        order.ensure_one()
+        layout = layout or self.env['location.occupancy.layout'].search([], limit=1)
+        if not layout:
+            raise UserError(_("No occupancy layout configured."))
+
+        if not near_location:
+            near_location = self.env['sale.order'].search([
+                ('partner_id', '=', order.partner_id.id),
+                ('id', '!=', order.id),
+                ('state', 'in', list(OCCUPANCY_ORDER_STATES)),
+                ('source_location_id.occupancy_layout_id', '=', layout.id),
+            ], order='id desc', limit=1).source_location_id
+
+        cr = self.env.cr
+        tried = []
+        location_id = None
+        while location_id is None:
+            cr.execute("""
+                SELECT id
+                  FROM stock_location
+                 WHERE occupancy_layout_id = %(layout)s
+                   AND occupancy_status = 'free' AND active AND usage = 'internal'
+                   AND id != ALL(%(tried)s)
+                   AND NOT EXISTS (
+                        -- Assigned to an order not yet counted (e.g. draft)
+                        SELECT 1 FROM sale_order so
+                         WHERE so.source_location_id = stock_location.id
+                           AND NOT so.state = ANY(%(released)s)
+                   )
+              ORDER BY occupancy_row IS NOT DISTINCT FROM %(row)s DESC,
+                       occupancy_level_seq DESC,
+                       abs(occupancy_column - %(column)s),
+                       occupancy_row_seq, occupancy_column, id
+                 LIMIT %(limit)s
+            """, {
+                'layout': layout.id,
+                'row': near_location.occupancy_row or None,
+                'column': near_location.occupancy_column or 0,
+                'tried': tried,
+                'released': list(OCCUPANCY_RELEASED_STATES),
+                'limit': ALLOCATION_CANDIDATES,
+            })
+            candidate_ids = [row[0] for row in cr.fetchall()]
+            if not candidate_ids:
+                raise UserError(_("No free location left in %s.") % layout.name)
+
+            for candidate_id in candidate_ids:
+                tried.append(candidate_id)
+                try:
+                    with cr.savepoint():
+                        cr.execute("""
+                            SELECT id FROM stock_location WHERE id = %s FOR UPDATE SKIP LOCKED
+                        """, [candidate_id], log_exceptions=False)
+                        locked = cr.fetchone()
+                        if locked:
+                            # Touch the row even if the order leaves the
+                            # status unchanged (e.g. draft), so allocations
+                            # that read it before our commit cannot lock it
+                            cr.execute("""
+                                UPDATE stock_location
+                                   SET write_date = (now() AT TIME ZONE 'UTC')
+                                 WHERE id = %s
+                            """, [candidate_id], log_exceptions=False)
+                except OperationalError as e:
+                    if e.pgcode != errorcodes.SERIALIZATION_FAILURE:
+                        raise
+                    continue  # Taken by an allocation committed meanwhile
+                if locked:
+                    location_id = candidate_id
+                    break
+
+        location = self.browse(location_id)
+        location.invalidate_cache(['write_date'])
+        order.write({'source_location_id': location.id})
+        _logger.info(f"Allocated {location.name} to {order.name}")
+        return location
+
+    # ============================================
+    # BULK OPERATIONS
+    # ============================================
+
+    @api.model
+    def _bulk_assign_orders(self, assignments):
+        """
+        Set source_location_id of many orders at once.
+
+        assignments: {order_id: location_id or False}
+
+        Orders go through the regular ORM write (one per target, one for
+        all cleared orders), with the per-write occupancy refresh turned
+        off; every location left or taken is then refreshed together: one
+        fetch, one history INSERT, one change log row and one bus
+        notification. Only reserved or occupied orders can be assigned,
+        a target must not be given twice, nor be held by an order outside
+        this call. Returns the affected locations.
+        """
+        if not assignments:
+            return self.browse()
+        SaleOrder = self.env['sale.order'].sudo()
+        orders = SaleOrder.browse(list(assignments)).exists()
+        if len(orders) != len(assignments):
+            raise UserError(_("Some orders do not exist."))
+        inactive = orders.filtered(lambda o: o.state not in OCCUPANCY_ORDER_STATES)
+        if inactive:
+            raise UserError(_("Only reserved or occupied orders can be assigned: %s") % ', '.join(
+                inactive.mapped('name')))
+
+        target_ids = [location_id for location_id in assignments.values() if location_id]
+        if len(target_ids) != len(set(target_ids)):
+            raise UserError(_("Several orders cannot be assigned to the same location."))
+        holders = SaleOrder.search([
+            ('source_location_id', 'in', target_ids),
+            ('state', 'not in', list(OCCUPANCY_RELEASED_STATES)),
+            ('id', 'not in', orders.ids),
+        ])
+        if holders:
+            raise UserError(_("Target locations are not free: %s") % ', '.join(
+                holders.mapped('source_location_id.name')))
+
+        locations = orders.mapped('source_location_id') | self.browse(target_ids)
+        orders_by_target = defaultdict(lambda: SaleOrder.browse())
+        for order in orders:
+            orders_by_target[assignments[order.id] or False] |= order
+        for location_id, target_orders in orders_by_target.items():
+            target_orders.with_context(skip_occupancy_refresh=True).write(
+                {'source_location_id': location_id})
+
+        locations._refresh_occupancy()
+        _logger.info(f"Bulk assigned {len(orders)} orders over {len(locations)} locations")
+        return locations
+
+    def _bulk_clear_locations(self):
+        """Unassign every active order from these locations"""
+        orders = self.env['sale.order'].sudo().search([
+            ('source_location_id', 'in', self.ids),
+            ('state', 'in', list(OCCUPANCY_ORDER_STATES)),
+        ])
+        return self._bulk_assign_orders(dict.fromkeys(orders.ids, False))
+
+    @api.model
+    def _bulk_move_locations(self, moves):
+        """
+        Move the active orders of locations to other locations.
+
+        moves: {from_location_id: to_location_id}. A target must be free,
+        or be vacated by the same call, and appear only once (checked by
+        _bulk_assign_orders).
+        """
+        if len(set(moves.values())) != len(moves):
+            raise UserError(_("Several locations cannot be moved to the same target."))
+        targets = self.browse(set(moves.values())).exists()
+        if len(targets) != len(set(moves.values())):
+            raise UserError(_("Some target locations do not exist."))
+
+        orders = self.env['sale.order'].sudo().search([
+            ('source_location_id', 'in', list(moves)),
+            ('state', 'in', list(OCCUPANCY_ORDER_STATES)),
+        ])
+        return self._bulk_assign_orders({
+            order.id: moves[order.source_location_id.id] for order in orders
+        })
+
+    def action_bulk_clear_occupancy(self):
+        """List view action: free the selected locations"""
+        self._bulk_clear_locations()
+        return True
+
     def _compute_occupancy_stats(self):
         """
         Compute 7-day statistics from location.occupancy.history
-        
-        TODO: Implement in Phase 4 after history model is created
+
+        All records are aggregated in a single SQL query.
         """
+        stats = self.env['location.occupancy.history'].sudo()._get_location_stats(
+            [location.id for location in self if isinstance(location.id, int)])
+        window_seconds = 7 * 24 * 3600.0
         for location in self:
-            # Placeholder - Phase 4
-            location.occupancy_rate_7d = 0.0
-            location.occupancy_avg_duration = 0.0
-            location.occupancy_times_used_7d = 0
-            location.occupancy_last_order = False
-            location.occupancy_last_freed = False
+            location_stats = stats.get(location.id)
+            if not location_stats:
+                location.occupancy_rate_7d = 0.0
+                location.occupancy_avg_duration = 0.0
+                location.occupancy_times_used_7d = 0
+                location.occupancy_last_order = False
+                location.occupancy_last_freed = False
+                continue
+
+            busy_hours = location_stats['busy_seconds'] / 3600.0
+            location.occupancy_rate_7d = round(100.0 * location_stats['busy_seconds'] / window_seconds, 1)
+            location.occupancy_avg_duration = (
+                busy_hours / location_stats['stints'] if location_stats['stints'] else 0.0
+            )
+            location.occupancy_times_used_7d = location_stats['uses']
+            location.occupancy_last_order = location_stats['last_order'] or False
+            location.occupancy_last_freed = location_stats['last_freed'] or False
@@ -8,23 +8,67 @@ odoo.define('personalizirai_location_occupancy.GridWidget', function (require) {
     var _t = core._t;
     var QWeb = core.qweb;
 
+    // Must match OCCUPANCY_BUS_CHANNEL in models/stock_location.py
+    var OCCUPANCY_CHANNEL = 'personalizirai_location_occupancy';
+
+    // Bus pushes changes; polling only catches missed notifications.
+    // The delay starts at the server hint (or this), doubles after each
+    // unchanged/failed poll up to POLL_MAX_MS and is spread by +-jitter.
+    var FALLBACK_REFRESH_MS = 300000; // 5 minutes
+    var POLL_MAX_MS = 1800000; // 30 minutes
+    var POLL_BACKOFF = 2;
+    var POLL_JITTER = 0.2;
+    // Spread of the refresh when a hidden tab becomes visible again
+    var VISIBLE_JITTER_MS = 3000;
+
+    // Virtual scrolling: rows within this distance of the viewport are
+    // rendered, and this many neighbouring rows are fetched in advance
+    var VIEWPORT_MARGIN_PX = 600;
+    var ROW_PREFETCH = 1;
+
+    // Placeholder height of a row that has not been rendered yet
+    var ROW_BASE_HEIGHT = 180;
+    var LEVEL_HEIGHT = 60;
+
+    // Quick search: wait for typing to pause, ignore very short queries
+    var SEARCH_DEBOUNCE_MS = 250;
+    var SEARCH_MIN_LENGTH = 2;
+
+    // Time slider: at most one replay frame request per interval while
+    // scrubbing; the slider range (a shift) is set in the template
+    var REPLAY_THROTTLE_MS = 200;
+
     /**
      * Interactive Grid Dashboard Widget for Location Occupancy
      * 
-     * Displays PR-1 locations organized by physical structure:
+     * Displays warehouse locations organized by physical structure
+     * (rows, each with levels top → bottom), e.g. PR-1:
      * - Row A (Редица A) - 70 positions
      * - Row B (Редица B) - 61 positions
      * Each row has 5 levels: E (top) → D → C → B → A (bottom)
      * 
+     * Only the row index is loaded up front. Rows are fetched in slices
+     * and rendered when they scroll near the viewport (virtual scrolling),
+     * so paint time and memory stay flat for large warehouses.
+     * 
      * Features:
      * - Color-coded status (green/yellow/red)
      * - Click to view details
-     * - Auto-refresh every 60 seconds
+     * - Live updates over the Odoo bus (5 minute polling fallback)
+     * - Time slider replaying the last shift
      * - Summary statistics
      * - Physical warehouse layout visualization
      */
     var OccupancyGridWidget = AbstractAction.extend({
         template: 'LocationOccupancyGrid',
+
+        events: {
+            'click .location-box': '_onLocationBoxClick',
+            'change .js-layout-select': '_onLayoutChange',
+            'input .js-occupancy-search': '_onSearchInput',
+            'change .js-heatmap-select': '_onHeatmapChange',
+            'input .js-replay-slider': '_onReplayInput',
+        },
         
         /**
          * Widget initialization
@@ -32,9 +76,32 @@ odoo.define('personalizirai_location_occupancy.GridWidget', function (require) {
         init: function (parent, action) {
             this._super.apply(this, arguments);
             this.action = action;
-            this.gridData = null;
-            this.refreshInterval = null;
+            this.gridData = null;  // version, layout(s) and row_index
+            this.summary = null;
+            this.layoutId = null;  // null = server default layout
+            this.locationIndex = {};  // location id -> cell data
+            this.rowCache = {};  // row index -> row data
+            this.rowRequests = {};  // row index -> true while fetching
+            this.visibleRows = {};  // row index -> true when near viewport
+            this.rowObserver = null;
+            this.refreshTimer = null;
+            this.pollDelay = FALLBACK_REFRESH_MS;
+            this.pollHint = null;  // next_poll (seconds) sent by the server
+            this.refreshOutcome = null;  // 'changed', 'unchanged' or 'error'
+            this.lastFetchAt = 0;
+            this.refreshStale = false;  // change notified while the page was hidden
+            this._onVisibilityChange = this._onVisibilityChange.bind(this);
             this.isRefreshing = false;
+            this.refreshPending = false;
+            this.searchQuery = '';
+            this.searchMatches = null;  // location id -> true, null when not searching
+            this.searchRequest = 0;  // ignores answers to outdated queries
+            this._debouncedSearch = _.debounce(this._search.bind(this), SEARCH_DEBOUNCE_MS);
+            this.heatmap = null;  // /occupancy/heatmap result while the overlay is on
+            this.asOf = null;  // UTC datetime replayed by the time slider, null = live
+            this.replayRequest = 0;  // id of the last replay frame requested
+            this.replayApplied = 0;  // id of the last replay frame shown
+            this._throttledReplay = _.throttle(this._fetchReplayFrame.bind(this), REPLAY_THROTTLE_MS);
         },
 
         /**
@@ -45,7 +112,8 @@ odoo.define('personalizirai_location_occupancy.GridWidget', function (require) {
             return this._super.apply(this, arguments).then(function () {
                 // Initial data load
                 return self._fetchAndRenderGrid().then(function() {
-                    // Start auto-refresh (60 seconds)
+                    // Subscribe to live updates, keep slow polling as fallback
+                    self._subscribeBus();
                     self._startAutoRefresh();
                     
                     // Bind manual refresh button
@@ -62,43 +130,351 @@ odoo.define('personalizirai_location_occupancy.GridWidget', function (require) {
          */
         destroy: function () {
             this._stopAutoRefresh();
+            if (this.rowObserver) {
+                this.rowObserver.disconnect();
+            }
+            this.call('bus_service', 'deleteChannel', OCCUPANCY_CHANNEL);
             this._super.apply(this, arguments);
         },
 
+        /**
+         * Listen for occupancy changes published by the server
+         */
+        _subscribeBus: function () {
+            this.call('bus_service', 'addChannel', OCCUPANCY_CHANNEL);
+            this.call('bus_service', 'onNotification', this, this._onBusNotification);
+            this.call('bus_service', 'startPolling');
+        },
+
+        /**
+         * Apply pushed occupancy changes
+         */
+        _onBusNotification: function (notifications) {
+            var self = this;
+            notifications.forEach(function (notification) {
+                var channel = notification[0];
+                var message = notification[1];
+                if (channel !== OCCUPANCY_CHANNEL || !self.gridData) {
+                    return;
+                }
+                // Our version is a watermark: a change stamped with it was
+                // still running when our data was read
+                if (message.version < self.gridData.version) {
+                    return; // Already have it
+                }
+                if (message.reload) {
+                    self.gridData.version = null; // Forces a full grid fetch
+                }
+                if (document.hidden) {
+                    self.refreshStale = true; // Fetched when the page is shown
+                    return;
+                }
+                self._requestRefresh();
+            });
+        },
+
+        /**
+         * Refresh now, or right after the refresh in progress finishes
+         */
+        _requestRefresh: function () {
+            if (this.isRefreshing) {
+                this.refreshPending = true;
+                return;
+            }
+            this._fetchAndRenderGrid();
+        },
+
         /**
          * Fetch data from backend and render grid
+         *
+         * First load fetches the full grid; later refreshes only fetch
+         * the cells changed since our version and patch them in place.
          */
         _fetchAndRenderGrid: function () {
             var self = this;
             
-            if (this.isRefreshing) {
-                return Promise.resolve(); // Prevent concurrent requests
+            if (this.isRefreshing || this.asOf) {
+                return Promise.resolve(); // Prevent concurrent requests, paused while replaying
             }
             
             this.isRefreshing = true;
+            this.refreshOutcome = 'unchanged';
             this._showLoading();
 
-            return ajax.jsonRpc('/occupancy/grid_data', 'call', {})
+            var load = this.gridData && this.gridData.version !== null ?
+                this._fetchDelta() : this._fetchFullGrid();
+
+            return load
+                .catch(function (error) {
+                    console.error('Grid data fetch failed:', error);
+                    self.refreshOutcome = 'error';
+                    self._showError('Failed to load grid data. Please refresh the page.');
+                })
+                .finally(function () {
+                    self.isRefreshing = false;
+                    self.lastFetchAt = Date.now();
+                    self._hideLoading();
+                    self._updatePollDelay();
+                    if (self.refreshPending) {
+                        self.refreshPending = false;
+                        self._fetchAndRenderGrid();
+                    } else {
+                        self._scheduleRefresh();
+                    }
+                });
+        },
+
+        /**
+         * Load the row index and summary, then render row placeholders
+         */
+        _fetchFullGrid: function () {
+            var self = this;
+
+            // Send our version so the server can answer "unchanged"
+            var params = {
+                version: this.gridData ? this.gridData.version : null,
+                layout_id: this.layoutId,
+                row_offset: 0,
+                row_limit: 0
+            };
+
+            var summary = this._fetchSummary();
+            var index = ajax.jsonRpc('/occupancy/grid_data', 'call', params)
                 .then(function (result) {
-                    if (result.success) {
+                    self._readPollHint(result);
+                    if (self.asOf) {
+                        return; // Replay started meanwhile; reloaded when it ends
+                    }
+                    if (result.success && result.unchanged) {
+                        self._updateRefreshTime();
+                    } else if (result.success) {
+                        self.refreshOutcome = 'changed';
                         self.gridData = result;
                         self._renderGrid();
                     } else {
+                        self.refreshOutcome = 'error';
                         self._showError(result.error || 'Unknown error');
                     }
+                });
+            return Promise.all([summary, index]);
+        },
+
+        /**
+         * Load the header counters (single aggregate query)
+         */
+        _fetchSummary: function () {
+            var self = this;
+            return ajax.jsonRpc('/occupancy/grid_summary', 'call', {
+                layout_id: this.layoutId
+            }).then(function (result) {
+                if (result.success && !self.asOf) {
+                    self.summary = result.summary;
+                    self._renderSummary();
+                }
+            });
+        },
+
+        /**
+         * Fetch a contiguous slice of rows covering the given indexes
+         */
+        _fetchRows: function (indexes) {
+            var self = this;
+            var first = Math.min.apply(null, indexes);
+            var last = Math.max.apply(null, indexes);
+            var layoutId = this.layoutId;
+
+            for (var i = first; i <= last; i++) {
+                this.rowRequests[i] = true;
+            }
+
+            var params = {
+                layout_id: layoutId,
+                row_offset: first,
+                row_limit: last - first + 1
+            };
+            if (this.asOf) {
+                params.as_of = this.asOf;
+            }
+            var query = $.param(params);
+            // Packed columnar rows, gzip-compressed by the server
+            return fetch('/occupancy/grid_packed?' + query, {credentials: 'same-origin'})
+                .then(function (response) {
+                    if (!response.ok) {
+                        throw new Error('HTTP ' + response.status);
+                    }
+                    return response.json();
                 })
-                .catch(function (error) {
-                    console.error('Grid data fetch failed:', error);
-                    self._showError('Failed to load grid data. Please refresh the page.');
+                .then(function (result) {
+                    if (!result.success || result.layout.id !== self.layoutId ||
+                            (result.as_of || null) !== self.asOf) {
+                        return; // Failed, or the user switched warehouse/moment meanwhile
+                    }
+                    // A worker rebuilding the snapshot serves the previous
+                    // one: catch up with a delta from the older version
+                    if (!self.asOf && self.gridData && self.gridData.version !== null &&
+                            result.version !== null && result.version < self.gridData.version) {
+                        self.gridData.version = result.version;
+                        self._requestRefresh();
+                    }
+                    self._unpackRows(result).forEach(function (row, position) {
+                        var rowIndex = result.row_offset + position;
+                        self._cacheRow(rowIndex, row);
+                        if (self.visibleRows[rowIndex]) {
+                            self._renderRow(rowIndex);
+                        }
+                    });
                 })
                 .finally(function () {
-                    self.isRefreshing = false;
-                    self._hideLoading();
+                    for (var i = first; i <= last; i++) {
+                        delete self.rowRequests[i];
+                    }
+                });
+        },
+
+        /**
+         * Turn packed rows (parallel arrays per level) back into cell objects
+         *
+         * Cells only carry what the grid draws; the details modal loads
+         * the rest from /occupancy/location/<id>.
+         */
+        _unpackRows: function (packed) {
+            var strings = packed.strings;
+            var statuses = packed.statuses;
+            var decode = function (index) {
+                return index === -1 ? null : strings[index];
+            };
+            return packed.rows.map(function (row) {
+                var levels = row.levels.map(function (level) {
+                    var locations = level.ids.map(function (id, i) {
+                        var columnLabel = decode(level.labels[i]);
+                        return {
+                            id: id,
+                            display_name: row.name + '-' + level.name + '-' + columnLabel,
+                            row: row.name,
+                            level: level.name,
+                            column: level.columns[i],
+                            column_label: columnLabel,
+                            status: statuses[level.status[i]],
+                            order: decode(level.orders[i])
+                        };
+                    });
+                    return _.extend(_.omit(level, 'ids', 'columns', 'labels', 'status', 'orders'), {
+                        locations: locations
+                    });
+                });
+                return _.extend({}, row, {levels: levels});
+            });
+        },
+
+        /**
+         * Keep fetched row data and index its cells by location id
+         */
+        _cacheRow: function (rowIndex, row) {
+            var self = this;
+            this.rowCache[rowIndex] = row;
+            row.levels.forEach(function (level) {
+                level.locations.forEach(function (location) {
+                    self.locationIndex[location.id] = location;
                 });
+            });
+        },
+
+        /**
+         * Load the cells changed since our version and patch them
+         */
+        _fetchDelta: function () {
+            var self = this;
+            var since = this.gridData.version;
+
+            return ajax.jsonRpc('/occupancy/grid_delta', 'call', {
+                since_version: since,
+                layout_id: this.layoutId
+            }).then(function (result) {
+                self._readPollHint(result);
+                if (self.asOf) {
+                    return; // Replay started meanwhile; reloaded when it ends
+                }
+                if (!result.success) {
+                    self.refreshOutcome = 'error';
+                    self._showError(result.error || 'Unknown error');
+                } else if (result.unchanged) {
+                    self._updateRefreshTime();
+                } else if (result.reload || !self._applyDelta(result, since)) {
+                    return self._fetchFullGrid();
+                } else {
+                    self.refreshOutcome = 'changed';
+                }
+            });
+        },
+
+        /**
+         * Patch changed cells in place
+         *
+         * Cells of rows not fetched yet are skipped (they will be loaded
+         * fresh). Returns false if a cell is new or moved within a loaded
+         * row, in which case the caller falls back to a full reload.
+         * The version only advances if it was not lowered (or reset)
+         * while the delta was loading.
+         */
+        _applyDelta: function (delta, since) {
+            var self = this;
+            var loadedRows = {};
+            _.each(this.rowCache, function (row) {
+                loadedRows[row.name] = true;
+            });
+
+            // New or re-positioned cells need a full re-render
+            var moved = (delta.cells || []).some(function (cell) {
+                var current = self.locationIndex[cell.id];
+                if (!current) {
+                    return !!loadedRows[cell.row];
+                }
+                return current.row !== cell.row ||
+                    current.level !== cell.level || current.column !== cell.column;
+            });
+            if (moved) {
+                return false;
+            }
+
+            delta.cells.forEach(function (cell) {
+                var current = self.locationIndex[cell.id];
+                if (!current) {
+                    return;
+                }
+                // Update the cached cell so the details modal stays current
+                _.extend(current, cell);
+                self._patchLocationBox(current);
+            });
+
+            if (this.gridData.version === since) {
+                this.gridData.version = delta.version;
+            }
+            this.summary = delta.summary;
+            this._renderSummary();
+            this._updateRefreshTime();
+            if (this.searchMatches) {
+                this._search(); // Orders may have moved
+            }
+            return true;
+        },
+
+        /**
+         * Update a single .location-box element to match its cell data
+         */
+        _patchLocationBox: function (location) {
+            var $box = this.$('.location-box[data-location-id="' + location.id + '"]');
+            $box.removeClass('status-free status-reserved status-occupied')
+                .addClass('status-' + location.status)
+                .attr('data-tooltip', location.display_name + ' - ' + location.status.toUpperCase() +
+                    (location.order ? ' (' + location.order + ')' : ''));
+            $box.find('.location-label').text(location.display_name);
         },
 
         /**
-         * Render grid with current data
+         * Render one placeholder per row and observe them
+         *
+         * Row content is rendered by _renderRow once a placeholder comes
+         * near the viewport and its data has been fetched.
          */
         _renderGrid: function () {
             if (!this.gridData) return;
@@ -108,38 +484,115 @@ odoo.define('personalizirai_location_occupancy.GridWidget', function (require) {
             
             // Clear existing content
             $grid.empty();
+            this.locationIndex = {};
+            this.rowCache = {};
+            this.rowRequests = {};
+            this.visibleRows = {};
+            if (this.rowObserver) {
+                this.rowObserver.disconnect();
+            }
+            this.rowObserver = new IntersectionObserver(this._onRowsIntersect.bind(this), {
+                root: this._getScrollRoot(),
+                rootMargin: VIEWPORT_MARGIN_PX + 'px 0px'
+            });
 
-            // Render summary
-            this._renderSummary();
+            // Render warehouse selector
+            this._renderLayouts();
 
-            // Render each row (Row A, Row B)
-            if (this.gridData.rows) {
-                this.gridData.rows.forEach(function(row) {
-                    var $row = $(QWeb.render('LocationOccupancyRow', {
-                        row: row
-                    }));
-                    
-                    // Add click handlers to location boxes
-                    $row.find('.location-box').on('click', function() {
-                        var locationId = $(this).data('location-id');
-                        self._showLocationDetails(locationId);
-                    });
-                    
-                    $grid.append($row);
-                });
-            }
+            // Clicks are handled by the delegated 'click .location-box' event
+            (this.gridData.row_index || []).forEach(function (rowInfo) {
+                var $slot = $('<div class="row-slot">')
+                    .attr('data-row-index', rowInfo.index)
+                    .css('min-height', ROW_BASE_HEIGHT + rowInfo.level_count * LEVEL_HEIGHT);
+                $grid.append($slot);
+                self.rowObserver.observe($slot[0]);
+            });
 
             // Update last refresh time
             this._updateRefreshTime();
         },
 
+        /**
+         * Element that scrolls the grid (viewport for the observer)
+         */
+        _getScrollRoot: function () {
+            var $root = this.$el.is('.occupancy-grid-dashboard') ?
+                this.$el : this.$('.occupancy-grid-dashboard');
+            return $root[0] || null;
+        },
+
+        /**
+         * Render rows entering the viewport, drop rows leaving it
+         */
+        _onRowsIntersect: function (entries) {
+            var self = this;
+            var rowCount = (this.gridData.row_index || []).length;
+
+            entries.forEach(function (entry) {
+                var rowIndex = parseInt(entry.target.getAttribute('data-row-index'), 10);
+                if (entry.isIntersecting) {
+                    self.visibleRows[rowIndex] = true;
+                } else {
+                    delete self.visibleRows[rowIndex];
+                    self._unrenderRow(rowIndex);
+                }
+            });
+
+            // Visible rows plus their neighbours, fetched in one slice
+            var missing = [];
+            Object.keys(this.visibleRows).forEach(function (key) {
+                var rowIndex = parseInt(key, 10);
+                for (var i = rowIndex - ROW_PREFETCH; i <= rowIndex + ROW_PREFETCH; i++) {
+                    if (i >= 0 && i < rowCount && !self.rowCache[i] &&
+                            !self.rowRequests[i] && missing.indexOf(i) === -1) {
+                        missing.push(i);
+                    }
+                }
+                if (self.rowCache[rowIndex]) {
+                    self._renderRow(rowIndex);
+                }
+            });
+
+            if (missing.length) {
+                this._fetchRows(missing).catch(function (error) {
+                    console.error('Row fetch failed:', error);
+                });
+            }
+        },
+
+        /**
+         * Render a cached row into its placeholder
+         */
+        _renderRow: function (rowIndex) {
+            var $slot = this.$('.row-slot[data-row-index="' + rowIndex + '"]');
+            if (!$slot.length || $slot.hasClass('is-rendered')) {
+                return;
+            }
+            $slot.html(QWeb.render('LocationOccupancyRow', {
+                row: this.rowCache[rowIndex]
+            })).addClass('is-rendered');
+            this._applySearchHighlight($slot);
+            this._applyHeatmap($slot);
+        },
+
+        /**
+         * Replace an off-screen row by an empty placeholder of the same height
+         */
+        _unrenderRow: function (rowIndex) {
+            var $slot = this.$('.row-slot[data-row-index="' + rowIndex + '"]');
+            if (!$slot.hasClass('is-rendered')) {
+                return;
+            }
+            $slot.css('min-height', $slot.outerHeight()).empty().removeClass('is-rendered');
+        },
+
         /**
          * Render summary statistics
          */
         _renderSummary: function () {
-            if (!this.gridData || !this.gridData.summary) return;
+            if (!this.summary) return;
 
-            var summary = this.gridData.summary;
+            var summary = this.summary;
             this.$('.summary-total').text(summary.total);
             this.$('.summary-free').text(summary.free);
             this.$('.summary-reserved').text(summary.reserved);
@@ -147,35 +600,291 @@ odoo.define('personalizirai_location_occupancy.GridWidget', function (require) {
         },
 
         /**
-         * Show location details in modal
+         * Delegated click handler for all location boxes
          */
-        _showLocationDetails: function (locationId) {
-            if (!this.gridData || !this.gridData.rows) return;
-
-            // Find location in data (search through rows and levels)
-            var location = null;
-            this.gridData.rows.forEach(function(row) {
-                if (location) return; // Already found
-                
-                row.levels.forEach(function(level) {
-                    if (location) return; // Already found
-                    
-                    var found = level.locations.find(function(loc) {
-                        return loc.id === locationId;
-                    });
-                    
-                    if (found) location = found;
+        _onLocationBoxClick: function (ev) {
+            this._showLocationDetails($(ev.currentTarget).data('location-id'));
+        },
+
+        /**
+         * Render the warehouse title and selector
+         */
+        _renderLayouts: function () {
+            var layout = this.gridData.layout;
+            var layouts = this.gridData.layouts || [];
+            if (!layout) return;
+
+            this.layoutId = layout.id;
+            this.$('.grid-layout-name').text(layout.name);
+            this.$('.js-export-link').each(function () {
+                $(this).attr('href', '/occupancy/export/grid?' + $.param({
+                    file_format: $(this).data('format'),
+                    layout_id: layout.id
+                }));
+            });
+
+            var $select = this.$('.js-layout-select').empty();
+            layouts.forEach(function (item) {
+                $('<option>').val(item.id).text(item.name)
+                    .prop('selected', item.id === layout.id)
+                    .appendTo($select);
+            });
+            $select.toggleClass('d-none', layouts.length < 2);
+        },
+
+        /**
+         * Switch to another warehouse layout
+         */
+        _onLayoutChange: function (ev) {
+            this.layoutId = parseInt($(ev.currentTarget).val(), 10);
+            this._resetReplay();
+            this.$('.js-occupancy-search').val('');
+            this.searchQuery = '';
+            this.searchMatches = null;
+            this.$('.js-heatmap-select').val('0');
+            this.heatmap = null;
+            this.gridData = null; // Forces a full grid fetch
+            this._requestRefresh();
+        },
+
+        /**
+         * Search as the user types
+         */
+        _onSearchInput: function (ev) {
+            this.searchQuery = $(ev.currentTarget).val().trim();
+            this._debouncedSearch();
+        },
+
+        /**
+         * Ask the server which locations match the query and highlight them
+         */
+        _search: function () {
+            var self = this;
+            var requestId = ++this.searchRequest;
+
+            if (this.searchQuery.length < SEARCH_MIN_LENGTH) {
+                this.searchMatches = null;
+                this._applySearchHighlight();
+                return Promise.resolve();
+            }
+
+            return ajax.jsonRpc('/occupancy/search', 'call', {
+                query: this.searchQuery,
+                layout_id: this.layoutId
+            }).then(function (result) {
+                if (requestId !== self.searchRequest) {
+                    return; // A newer query was sent meanwhile
+                }
+                if (!result.success) {
+                    self._showError(result.error || 'Search failed');
+                    return;
+                }
+                self.searchMatches = {};
+                result.matches.forEach(function (match) {
+                    self.searchMatches[match.id] = true;
                 });
+                self._applySearchHighlight();
+                if (result.matches.length) {
+                    self._scrollToRow(result.matches[0].row);
+                }
+            });
+        },
+
+        /**
+         * Mark matching boxes (in $scope, default: the whole grid)
+         */
+        _applySearchHighlight: function ($scope) {
+            var matches = this.searchMatches;
+            this.$('.occupancy-grid-container').toggleClass('is-searching', !!matches);
+            ($scope || this.$('.occupancy-grid-container')).find('.location-box').each(function () {
+                $(this).toggleClass('is-search-match',
+                    !!matches && !!matches[$(this).data('location-id')]);
             });
+        },
 
-            if (!location) {
+        /**
+         * Turn the utilization overlay on (30/90 days) or off
+         */
+        _onHeatmapChange: function (ev) {
+            var self = this;
+            var days = parseInt($(ev.currentTarget).val(), 10);
+            if (!days) {
+                this.heatmap = null;
+                this._applyHeatmap();
+                return Promise.resolve();
+            }
+            return ajax.jsonRpc('/occupancy/heatmap', 'call', {
+                layout_id: this.layoutId,
+                days: days
+            }).then(function (result) {
+                if (!result.success) {
+                    self._showError(result.error || 'Heatmap failed');
+                    return;
+                }
+                self.heatmap = result;
+                self._applyHeatmap();
+            });
+        },
+
+        /**
+         * Shade boxes (in $scope, default: the whole grid) by utilization
+         */
+        _applyHeatmap: function ($scope) {
+            var heatmap = this.heatmap;
+            this.$('.occupancy-grid-container').toggleClass('is-heatmap', !!heatmap);
+            ($scope || this.$('.occupancy-grid-container')).find('.location-box').each(function () {
+                var cell = heatmap && heatmap.cells[$(this).data('location-id')];
+                if (!heatmap) {
+                    this.style.removeProperty('--heat');
+                    $(this).removeAttr('title');
+                    return;
+                }
+                var busy = cell ? cell.busy : 0;
+                this.style.setProperty('--heat', busy);
+                $(this).attr('title', Math.round(busy * 100) + '% busy (' + heatmap.days + ' days)');
+            });
+        },
+
+        /**
+         * Bring a row into view; its cells get fetched by the observer
+         */
+        _scrollToRow: function (rowName) {
+            var rowInfo = _.findWhere(this.gridData.row_index || [], {name: rowName});
+            if (!rowInfo) {
+                return;
+            }
+            var $slot = this.$('.row-slot[data-row-index="' + rowInfo.index + '"]');
+            if ($slot.length) {
+                $slot[0].scrollIntoView({behavior: 'smooth', block: 'start'});
+            }
+        },
+
+        /**
+         * Move through the last shift; back at the right end = live
+         */
+        _onReplayInput: function (ev) {
+            var minutes = parseInt($(ev.currentTarget).val(), 10);
+            if (!minutes) {
+                this._resetReplay();
+                if (this.gridData) {
+                    this.gridData.version = null; // Forces a full (live) grid fetch
+                }
+                this._requestRefresh();
+                return;
+            }
+            var instant = new Date(Date.now() + minutes * 60000);
+            instant.setSeconds(0, 0);
+            this.asOf = instant.toISOString().slice(0, 19).replace('T', ' ');
+            clearTimeout(this.refreshTimer);
+            this.refreshTimer = null;
+            this.$('.occupancy-grid-container').addClass('is-replaying');
+            this.$('.js-replay-time').text('⏪ ' + instant.toLocaleTimeString('bg-BG', {
+                hour: '2-digit',
+                minute: '2-digit'
+            }));
+            this._throttledReplay();
+        },
+
+        /**
+         * Back to live data (the caller reloads the grid if needed)
+         */
+        _resetReplay: function () {
+            this.asOf = null;
+            this.replayRequest++;
+            this.replayApplied = this.replayRequest;
+            this.$('.js-replay-slider').val(0);
+            this.$('.js-replay-time').text(_t('Live'));
+            this.$('.occupancy-grid-container').removeClass('is-replaying');
+        },
+
+        /**
+         * Load the whole grid as of this.asOf and patch every cell
+         *
+         * One packed request per frame; placement does not change, so
+         * rendered boxes are patched in place and other rows are cached
+         * for when they scroll into view. Frames arriving out of order
+         * are dropped.
+         */
+        _fetchReplayFrame: function () {
+            var self = this;
+            if (!this.asOf) {
+                return Promise.resolve();
+            }
+            var requestId = ++this.replayRequest;
+            var query = $.param({layout_id: this.layoutId, as_of: this.asOf});
+
+            this._showLoading();
+            return fetch('/occupancy/grid_packed?' + query, {credentials: 'same-origin'})
+                .then(function (response) {
+                    if (!response.ok) {
+                        throw new Error('HTTP ' + response.status);
+                    }
+                    return response.json();
+                })
+                .then(function (result) {
+                    if (requestId <= self.replayApplied || !self.asOf) {
+                        return; // A later frame is already shown, or back to live
+                    }
+                    if (!result.success) {
+                        self._showError(result.error || 'Replay failed');
+                        return;
+                    }
+                    self.replayApplied = requestId;
+                    self._unpackRows(result).forEach(function (row, rowIndex) {
+                        self._cacheRow(rowIndex, row);
+                        row.levels.forEach(function (level) {
+                            level.locations.forEach(self._patchLocationBox.bind(self));
+                        });
+                    });
+                    self.summary = result.summary;
+                    self._renderSummary();
+                })
+                .catch(function (error) {
+                    console.error('Replay frame failed:', error);
+                })
+                .finally(function () {
+                    if (requestId === self.replayRequest) {
+                        self._hideLoading();
+                    }
+                });
+        },
+
+        /**
+         * Show location details in modal
+         */
+        _showLocationDetails: function (locationId) {
+            var self = this;
+            var cell = this.locationIndex[locationId];
+
+            if (!cell) {
                 console.error('Location not found:', locationId);
                 return;
             }
 
-            // Render modal with location details
+            // Replaying: only the replayed status and order are known
+            if (this.asOf) {
+                this._openDetailsModal(cell, this.$('.js-replay-time').text());
+                return Promise.resolve();
+            }
+
+            // Customer, box and duration are only loaded for the opened cell
+            return ajax.jsonRpc('/occupancy/location/' + locationId, 'call', {})
+                .then(function (result) {
+                    if (!result.success) {
+                        self._showError(result.error || 'Unknown error');
+                        return;
+                    }
+                    self._openDetailsModal(result.location, null);
+                });
+        },
+
+        /**
+         * Render and show the details modal (replayed: label of the moment)
+         */
+        _openDetailsModal: function (location, replayed) {
             var $modal = $(QWeb.render('LocationDetailsModal', {
-                location: location
+                location: location,
+                replayed: replayed
             }));
 
             // Add to DOM
@@ -191,25 +900,78 @@ odoo.define('personalizirai_location_occupancy.GridWidget', function (require) {
         },
 
         /**
-         * Start auto-refresh timer (60 seconds)
+         * Start the fallback refresh scheduler
          */
         _startAutoRefresh: function () {
-            var self = this;
-            this._stopAutoRefresh(); // Clear existing timer
-            
-            this.refreshInterval = setInterval(function() {
-                console.log('🔄 Auto-refreshing grid data...');
-                self._fetchAndRenderGrid();
-            }, 60000); // 60 seconds
+            document.addEventListener('visibilitychange', this._onVisibilityChange);
+            this._scheduleRefresh();
         },
 
         /**
-         * Stop auto-refresh timer
+         * Stop the scheduler
          */
         _stopAutoRefresh: function () {
-            if (this.refreshInterval) {
-                clearInterval(this.refreshInterval);
-                this.refreshInterval = null;
+            document.removeEventListener('visibilitychange', this._onVisibilityChange);
+            clearTimeout(this.refreshTimer);
+            this.refreshTimer = null;
+        },
+
+        /**
+         * (Re)arm the timer for the next poll; nothing runs while hidden
+         *
+         * Every fetch (bus, manual or timer) re-arms it, so polls only
+         * happen after pollDelay without any other refresh.
+         */
+        _scheduleRefresh: function () {
+            clearTimeout(this.refreshTimer);
+            this.refreshTimer = null;
+            if (document.hidden || this.isDestroyed() || this.asOf) {
+                return;
+            }
+            var jitter = 1 + (Math.random() * 2 - 1) * POLL_JITTER;
+            this.refreshTimer = setTimeout(this._fetchAndRenderGrid.bind(this), this.pollDelay * jitter);
+        },
+
+        /**
+         * Keep the next_poll hint of a grid_data/grid_delta response
+         */
+        _readPollHint: function (result) {
+            if (result && result.next_poll) {
+                this.pollHint = result.next_poll * 1000;
+            }
+        },
+
+        /**
+         * Back off after unchanged/failed polls, reset after a change
+         */
+        _updatePollDelay: function () {
+            var base = this.pollHint || FALLBACK_REFRESH_MS;
+            if (this.refreshOutcome === 'changed') {
+                this.pollDelay = base;
+            } else {
+                this.pollDelay = Math.min(
+                    Math.max(this.pollDelay, base) * POLL_BACKOFF, Math.max(POLL_MAX_MS, base));
+            }
+        },
+
+        /**
+         * Pause polling in hidden tabs, catch up when shown again
+         */
+        _onVisibilityChange: function () {
+            if (document.hidden) {
+                clearTimeout(this.refreshTimer);
+                this.refreshTimer = null;
+                return;
+            }
+            if (this.refreshStale || Date.now() - this.lastFetchAt >= this.pollDelay) {
+                // Many wall screens waking up together should not fire at once
+                this.refreshStale = false;
+                this.pollDelay = this.pollHint || FALLBACK_REFRESH_MS;
+                clearTimeout(this.refreshTimer);
+                this.refreshTimer = setTimeout(
+                    this._requestRefresh.bind(this), Math.random() * VISIBLE_JITTER_MS);
+            } else {
+                this._scheduleRefresh();
             }
         },
 
@@ -218,6 +980,10 @@ odoo.define('personalizirai_location_occupancy.GridWidget', function (require) {
          */
         _manualRefresh: function () {
             console.log('🔄 Manual refresh triggered');
+            if (this.asOf) {
+                this._fetchReplayFrame();
+                return;
+            }
             this._fetchAndRenderGrid();
         },
 
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+from . import test_allocation_concurrency
+from . import test_occupancy_fetch
+from . import test_occupancy_replay
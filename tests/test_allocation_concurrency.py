@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from odoo import api, SUPERUSER_ID
+from odoo.tests.common import TransactionCase, tagged
+
+PARALLEL_ALLOCATIONS = 4
+
+
+@tagged('post_install', '-at_install')
+class TestAllocationConcurrency(TransactionCase):
+    """Parallel allocations must each reserve a different location, without errors"""
+
+    def setUp(self):
+        super(TestAllocationConcurrency, self).setUp()
+        # Every allocation runs on its own cursor, so the data must be committed
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            root = env['stock.location'].create({'name': 'TEST-ALLOC-ROOT', 'usage': 'view'})
+            layout = env['location.occupancy.layout'].create({
+                'name': 'TEST-ALLOC',
+                'root_location_id': root.id,
+            })
+            locations = env['stock.location'].create([{
+                'name': f'Z-E-{column:03d}',
+                'location_id': root.id,
+                'usage': 'internal',
+            } for column in range(1, 2 * PARALLEL_ALLOCATIONS + 1)])
+            partner = env['res.partner'].create({'name': 'Allocation Test Customer'})
+            orders = env['sale.order'].create([
+                {'partner_id': partner.id} for _i in range(PARALLEL_ALLOCATIONS)])
+            self.location_ids = (root | locations).ids
+            self.layout_id = layout.id
+            self.partner_id = partner.id
+            self.order_ids = orders.ids
+        self.addCleanup(self._cleanup)
+
+    def _cleanup(self):
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['sale.order'].browse(self.order_ids).unlink()
+            env['location.occupancy.layout'].browse(self.layout_id).unlink()
+            env['stock.location'].browse(self.location_ids).unlink()
+            env['res.partner'].browse(self.partner_id).unlink()
+
+    def _allocate(self, order_id, barrier, results, errors):
+        with api.Environment.manage(), self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            order = env['sale.order'].browse(order_id)
+            layout = env['location.occupancy.layout'].browse(self.layout_id)
+            layout.name  # Start the transaction before the others commit
+            barrier.wait(timeout=30)
+            try:
+                location = env['stock.location']._allocate_free_location(order, layout)
+                env['base'].flush()
+                results[order_id] = location.id
+            except Exception as e:
+                cr.rollback()
+                errors.append(e)
+
+    def test_parallel_allocations(self):
+        barrier = threading.Barrier(PARALLEL_ALLOCATIONS)
+        results = {}
+        errors = []
+        threads = [
+            threading.Thread(target=self._allocate, args=(order_id, barrier, results, errors))
+            for order_id in self.order_ids
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(results), sorted(self.order_ids))
+        self.assertEqual(len(set(results.values())), PARALLEL_ALLOCATIONS,
+                         "Two orders were given the same location")
+        self.assertTrue(set(results.values()) <= set(self.location_ids))
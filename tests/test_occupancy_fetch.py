@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from odoo.tests.common import SavepointCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestOccupancyFetch(SavepointCase):
+    """The occupancy fetch must not run more queries for more locations"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestOccupancyFetch, cls).setUpClass()
+        cls.root = cls.env['stock.location'].create({'name': 'TEST-ROOT', 'usage': 'view'})
+        cls.layout = cls.env['location.occupancy.layout'].create({
+            'name': 'TEST',
+            'root_location_id': cls.root.id,
+        })
+        cls.partner = cls.env['res.partner'].create({'name': 'Occupancy Test Customer'})
+
+    def _create_busy_locations(self, row, count):
+        """count grid locations of row, each held by a reserved order"""
+        locations = self.env['stock.location'].create([{
+            'name': f'{row}-E-{column:03d}',
+            'location_id': self.root.id,
+            'usage': 'internal',
+        } for column in range(1, count + 1)])
+        orders = self.env['sale.order'].create([{
+            'partner_id': self.partner.id,
+            'source_location_id': location.id,
+        } for location in locations])
+        orders.write({'state': 'manufactured'})
+        return locations
+
+    def _count_fetch_queries(self, locations):
+        self.env['stock.location'].flush()
+        locations.invalidate_cache()
+        start = self.env.cr.sql_log_count
+        values_map, _conflicts = locations._fetch_occupancy_values()
+        count = self.env.cr.sql_log_count - start
+        self.assertEqual(len(values_map), len(locations))
+        return count
+
+    def _assert_constant_query_count(self):
+        small = self._create_busy_locations('A', 10)
+        large = self._create_busy_locations('B', 100)
+        self._count_fetch_queries(small)  # Warm up parameter caches
+        self.assertEqual(self._count_fetch_queries(small), self._count_fetch_queries(large))
+
+    def test_orm_engine_query_count(self):
+        self.env['ir.config_parameter'].sudo().set_param(
+            'personalizirai_location_occupancy.sql_engine', False)
+        self._assert_constant_query_count()
+
+    def test_sql_engine_query_count(self):
+        self.env['ir.config_parameter'].sudo().set_param(
+            'personalizirai_location_occupancy.sql_engine', '1')
+        self._assert_constant_query_count()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+import json
+
+from odoo import fields
+from odoo.tests.common import SavepointCase, tagged
+
+# Far enough in the past that no real checkpoint precedes it
+T0 = datetime(2000, 1, 1)
+CHECKPOINT_AT = T0 + timedelta(hours=2)
+
+
+@tagged('post_install', '-at_install')
+class TestOccupancyReplay(SavepointCase):
+    """The grid replayed at a past moment must match the transitions logged"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestOccupancyReplay, cls).setUpClass()
+        root = cls.env['stock.location'].create({'name': 'TEST-REPLAY-ROOT', 'usage': 'view'})
+        cls.a, cls.b, cls.c, cls.d, cls.e = cls.env['stock.location'].create([{
+            'name': name,
+            'location_id': root.id,
+            'usage': 'internal',
+        } for name in ('R-A', 'R-B', 'R-C', 'R-D', 'R-E')])
+        partner = cls.env['res.partner'].create({'name': 'Replay Test Customer'})
+        cls.o1, cls.o2, cls.o3, cls.o4, cls.o5 = cls.env['sale.order'].create([
+            {'partner_id': partner.id} for _i in range(5)])
+
+        def transition(location, from_status, to_status, order, at):
+            return {
+                'location_id': location.id,
+                'order_id': order.id,
+                'from_status': from_status,
+                'to_status': to_status,
+                'timestamp': at,
+            }
+
+        cls.env['location.occupancy.history']._log_transitions([
+            # E: held by one order, then handed to another without being freed
+            transition(cls.e, 'free', 'reserved', cls.o2, T0 + timedelta(minutes=10)),
+            transition(cls.e, 'reserved', 'reserved', cls.o5, CHECKPOINT_AT + timedelta(minutes=30)),
+            # C: busy before the checkpoint, freed after it
+            transition(cls.c, 'free', 'occupied', cls.o3, T0 + timedelta(minutes=30)),
+            transition(cls.c, 'occupied', 'free', cls.o3, CHECKPOINT_AT + timedelta(minutes=10)),
+            # A: free → reserved → occupied, a stint crossing the checkpoint
+            transition(cls.a, 'free', 'reserved', cls.o1, T0 + timedelta(hours=1)),
+            transition(cls.a, 'reserved', 'occupied', cls.o1, T0 + timedelta(hours=3)),
+            # B: logged inside the replay margin, committed after the checkpoint read
+            transition(cls.b, 'free', 'reserved', cls.o2, CHECKPOINT_AT - timedelta(minutes=2)),
+            # D: logged inside the replay margin, already in the checkpoint
+            transition(cls.d, 'free', 'reserved', cls.o4, CHECKPOINT_AT - timedelta(minutes=1)),
+        ])
+        cls.location_ids = (cls.a | cls.b | cls.c | cls.d | cls.e).ids
+
+    def _take_checkpoint(self):
+        def entry(status, order, since):
+            return [status, order.id, fields.Datetime.to_string(since)]
+
+        self.env['location.occupancy.checkpoint'].create({
+            'taken_at': CHECKPOINT_AT,
+            'payload': json.dumps({
+                self.a.id: entry('reserved', self.o1, T0 + timedelta(hours=1)),
+                self.c.id: entry('occupied', self.o3, T0 + timedelta(minutes=30)),
+                self.d.id: entry('reserved', self.o4, CHECKPOINT_AT - timedelta(minutes=1)),
+                self.e.id: entry('reserved', self.o2, T0 + timedelta(minutes=10)),
+            }),
+        })
+
+    def _replay(self, as_of):
+        return self.env['location.occupancy.history']._get_occupancy_as_of(self.location_ids, as_of)
+
+    def _assert_replay_after_checkpoint(self):
+        self.assertEqual(self._replay(T0 + timedelta(hours=4)), {
+            self.a.id: ('occupied', self.o1.id, T0 + timedelta(hours=1)),
+            self.b.id: ('reserved', self.o2.id, CHECKPOINT_AT - timedelta(minutes=2)),
+            self.d.id: ('reserved', self.o4.id, CHECKPOINT_AT - timedelta(minutes=1)),
+            self.e.id: ('reserved', self.o5.id, CHECKPOINT_AT + timedelta(minutes=30)),
+        })
+
+    def test_replay_without_checkpoint(self):
+        self._assert_replay_after_checkpoint()
+        self.assertEqual(self._replay(T0 + timedelta(minutes=45)), {
+            self.c.id: ('occupied', self.o3.id, T0 + timedelta(minutes=30)),
+            self.e.id: ('reserved', self.o2.id, T0 + timedelta(minutes=10)),
+        })
+
+    def test_replay_from_checkpoint(self):
+        self._take_checkpoint()
+        self._assert_replay_after_checkpoint()
+        self.assertEqual(self._replay(CHECKPOINT_AT + timedelta(minutes=5)), {
+            self.a.id: ('reserved', self.o1.id, T0 + timedelta(hours=1)),
+            self.b.id: ('reserved', self.o2.id, CHECKPOINT_AT - timedelta(minutes=2)),
+            self.c.id: ('occupied', self.o3.id, T0 + timedelta(minutes=30)),
+            self.d.id: ('reserved', self.o4.id, CHECKPOINT_AT - timedelta(minutes=1)),
+            self.e.id: ('reserved', self.o2.id, T0 + timedelta(minutes=10)),
+        })
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+from .metrics import metrics
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+from contextlib import contextmanager
+import bisect
+import os
+import threading
+import time
+
+# Latency buckets (seconds) of the duration histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'occupancy_requests_total': ('counter', "Occupancy HTTP requests"),
+    'occupancy_errors_total': ('counter', "Occupancy HTTP requests that failed"),
+    'occupancy_grid_snapshot_total': ('counter', "Grid snapshot lookups by result"),
+    'occupancy_refresh_locations_total': ('counter', "Locations recomputed by _refresh_occupancy"),
+    'occupancy_sql_queries_total': ('counter', "SQL queries run by an operation"),
+    'occupancy_sql_seconds_total': ('counter', "Time spent in SQL by an operation"),
+    'occupancy_duration_seconds': ('histogram', "Wall time of an operation"),
+}
+
+
+class Metrics(object):
+    """
+    In-process counters and histograms, rendered in Prometheus text format.
+
+    Values are per Odoo process: with several workers each scrape sees the
+    worker that answered, so aggregate them by the `pid` label.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets, total = self._histograms.get(key, ([0] * (len(DURATION_BUCKETS) + 1), 0.0))
+            buckets[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+            self._histograms[key] = (buckets, total + value)
+
+    @contextmanager
+    def timed(self, operation):
+        """Record wall time, SQL query count and SQL time of the block"""
+        thread = threading.current_thread()
+        start_count = getattr(thread, 'query_count', 0)
+        start_sql = getattr(thread, 'query_time', 0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('occupancy_duration_seconds', time.perf_counter() - start, operation=operation)
+            self.inc('occupancy_sql_queries_total',
+                     getattr(thread, 'query_count', 0) - start_count, operation=operation)
+            self.inc('occupancy_sql_seconds_total',
+                     getattr(thread, 'query_time', 0.0) - start_sql, operation=operation)
+
+    def render(self, gauges=()):
+        """
+        Prometheus exposition text.
+
+        gauges: extra (name, help, [(labels, value)]) computed at scrape time
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(buckets), total) for key, (buckets, total) in self._histograms.items()}
+
+        pid = (('pid', os.getpid()),)
+        lines = []
+        for name, (kind, help_text) in sorted(HELP.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(pid + labels)} {value:g}")
+                continue
+            for (metric, labels), (buckets, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS + ('+Inf',), buckets):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(pid + labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pid + labels)} {total:g}")
+                lines.append(f"{name}_count{_labels(pid + labels)} {cumulative}")
+
+        for name, help_text, samples in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(pid + tuple(sorted(labels.items())))} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+metrics = Metrics()